@@ -1,3 +1,3 @@
-from .grade import Tester, Check
+from .grade import Tester, Check, Sweep
 from .command_line import command_line
 import utils
\ No newline at end of file
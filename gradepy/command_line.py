@@ -1,41 +1,216 @@
 from __future__ import print_function
 
+from collections import OrderedDict
 from contextlib import contextmanager
+from Queue import Queue
+import atexit
+import errno
 import os
 import imp
 import re
 import sys
+import threading
+
+import utils
 
 def command_line(tester=None, grade_package=None):
     from argparse import ArgumentParser
     parser = ArgumentParser(description='Tests student python modules.')
-    parser.add_argument('files', nargs='+', metavar='file',
+    parser.add_argument('files', nargs='*', metavar='file',
                         help='paths to student modules')
     parser.add_argument('-csv', dest='csv', const=True, action='store_const',
                         help='create csv from feedback files')
+    parser.add_argument('-by-test', dest='by_test', const=True, action='store_const',
+                        help='with -csv, add a column of deductions for each '
+                             'test function')
     parser.add_argument('-test', metavar='regex', type=re.compile,
                         help='regex query to select test functions')
     parser.add_argument('-', dest='stdout', const=True, action='store_const', 
                         help='write to stdout')
+    parser.add_argument('-jobs', metavar='N', type=int, default=1,
+                        help='number of worker processes to grade with')
+    parser.add_argument('-incremental', const=True, action='store_const',
+                        help='only rerun tests whose inputs changed since the '
+                             'last run, updating the existing feedback files')
+    parser.add_argument('-profile', const=True, action='store_const',
+                        help='print how long each phase of grading took, and '
+                             'write every timing to the -trace file')
+    parser.add_argument('-trace', metavar='path', default='gradepy_profile.jsonl',
+                        help='where -profile writes timings (default: %(default)s)')
+    parser.add_argument('-fork', const=True, action='store_const',
+                        help='grade each file in a child process forked from a '
+                             'warm parent; with -jobs, several children run at once')
+    parser.add_argument('-fork-timeout', dest='fork_timeout', metavar='seconds',
+                        type=float,
+                        help='with -fork, kill a child after this many seconds')
+    parser.add_argument('-daemon', const=True, action='store_const',
+                        help='keep test scripts loaded and grade the files sent '
+                             'by -client')
+    parser.add_argument('-client', const=True, action='store_const',
+                        help='have the running -daemon grade the files')
+    parser.add_argument('-socket', metavar='path', default='.gradepy.sock',
+                        help='the socket of -daemon and -client '
+                             '(default: %(default)s)')
+    parser.add_argument('-watch', metavar='dir',
+                        help='grade student modules under dir whenever they '
+                             'are created or modified, instead of files')
 
     args = parser.parse_args()
+    if args.watch and args.files:
+        parser.error('-watch does not take files')
+    if not args.files and not (args.daemon or args.watch):
+        parser.error('too few arguments')
     if args.csv:
         import makecsv
-        makecsv.main(args.files)
+        makecsv.main(args.files, jobs=args.jobs, by_test=args.by_test)
+    elif args.daemon:
+        import daemon
+        daemon.serve(args.socket, tester, grade_package)
+    elif args.watch:
+        import watch
+        watch.watch(args.watch, args, tester, grade_package)
+    elif args.client:
+        import daemon
+        if not daemon.submit(args, args.socket):
+            print('No grading daemon is listening on {}; grading here.'
+                  .format(args.socket), file=sys.stderr)
+            run_tests(args, tester, grade_package)
     else:
         run_tests(args, tester, grade_package)
 
 
 def run_tests(args, tester=None, grade_package=None):
-    for file in args.files:
-        tester = tester or get_tester(file, grade_package=grade_package)
-        if tester:
-            if args.stdout:
-                tester(file, func_re=args.test)
-            else:
-                with logger(file) as log_func:
-                    tester(file, log_func=log_func, func_re=args.test)
-                    print('Wrote feedback to ' + log_func.file)
+    registry = TesterRegistry(tester, grade_package)
+    groups = registry.group(args.files)
+    profiler = None
+    if getattr(args, 'profile', None):
+        import timing
+        profiler = timing.Profiler()
+        for tester, _ in groups:
+            tester.profiler = profiler
+
+    if getattr(args, 'fork', None):
+        import zygote
+        zygote.run(args, groups, profiler)
+    elif getattr(args, 'jobs', 1) > 1:
+        files = [file for _, group in groups for file in group]
+        run_parallel(args, registry, files, profiler)
+    else:
+        for tester, files in groups:
+            for file in files:
+                grade_file(tester, file, args)
+
+    _WRITER.flush()
+    if profiler:
+        print(profiler.summary(), file=sys.stderr)
+        trace = getattr(args, 'trace', 'gradepy_profile.jsonl')
+        profiler.write_trace(trace)
+        print('Wrote timings to ' + trace, file=sys.stderr)
+
+
+def grade_file(tester, file, args, echo=print):
+    """Grades one file, writing feedback to a file or, with args.stdout, to echo."""
+    if getattr(args, 'incremental', False) and not args.stdout:
+        import incremental
+        incremental.regrade(tester, file, func_re=args.test, echo=echo)
+    elif args.stdout:
+        tester(file, log_func=echo, func_re=args.test)
+    else:
+        with logger(file) as log_func:
+            record = tester(file, log_func=log_func, func_re=args.test)
+            echo('Wrote feedback to ' + log_func.file)
+        # Like utils.write_record, but not on this thread.
+        _WRITER.write(utils.record_file(log_func.file), None,
+                      utils.format_record(record))
+
+
+class TesterRegistry(object):
+    """Loads and caches one Tester per graded module.
+
+    Args:
+        tester (Tester): if given, this Tester is used for every file.
+        grade_package (package): a package containing grade_MODULE
+          subpackages. Otherwise they are imported from the working directory.
+    """
+    def __init__(self, tester=None, grade_package=None):
+        self.tester = tester
+        self.grade_package = grade_package
+        self._testers = {}
+
+    def get(self, file):
+        """Returns the Tester for file, or None if there is no test script."""
+        if self.tester:
+            return self.tester
+        mod_name = os.path.basename(file)[:-3]
+        if mod_name not in self._testers:
+            self._testers[mod_name] = get_tester(file, self.grade_package)
+        elif self._testers[mod_name] is None:
+            print('ERROR: No testing script found for {}'
+                  .format(file), file=sys.stderr)
+        return self._testers[mod_name]
+
+    def group(self, files):
+        """Returns a list of (tester, files) pairs, one for each Tester.
+
+        Testers are loaded in the order in which their modules first
+        appear in files. Files without a test script are left out.
+        """
+        groups = OrderedDict()
+        for file in files:
+            tester = self.get(file)
+            if tester:
+                groups.setdefault(tester, []).append(file)
+        return groups.items()
+
+
+# State of a worker process in parallel mode. Workers are forked from the
+# main process, so they inherit these without pickling the Testers.
+_WORKER = {}
+
+
+def run_parallel(args, registry, files, profiler=None):
+    """Grades files across args.jobs worker processes.
+
+    Every Tester for files must be loaded before the workers are forked.
+    Each worker holds its own copy of them (and thus its own patched
+    sys.stdin and sys.stdout), and writes feedback files exactly as a
+    serial run would. Messages are printed by the main process in grading
+    order, and the timings of the workers are collected in profiler.
+    """
+    from multiprocessing import Pool
+    pool = Pool(args.jobs, _init_worker, (args, registry))
+    try:
+        for output, events in pool.imap(_grade_file, files):
+            sys.stdout.write(output)
+            if profiler:
+                profiler.events.extend(events)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _init_worker(args, registry):
+    _WORKER.update(args=args, registry=registry)
+
+
+def _grade_file(file):
+    """Grades one file in a worker process.
+
+    Returns what it printed and the timings recorded while grading.
+    """
+    from cStringIO import StringIO
+    out = StringIO()
+    def write(msg):
+        out.write(msg + '\n')
+
+    tester = _WORKER['registry'].get(file)
+    grade_file(tester, file, _WORKER['args'], echo=write)
+    _WRITER.flush()  # workers exit without running atexit functions
+    events = tester.profiler.take() if tester.profiler else []
+    return out.getvalue(), events
 
 
 def get_tester(file, grade_package=None):
@@ -57,20 +232,91 @@ def get_tester(file, grade_package=None):
 
 @contextmanager
 def logger(file):
-    template = file[:-3] + '_feedback{}.txt'
-    logfile = template.format('')
+    """Yields a function that writes messages to a new feedback file for file.
+
+    The file name is claimed on entry. Messages are formatted as they are
+    received and kept in memory; on exit they are written to the file in
+    one call by a background thread. Call _WRITER.flush() to wait for it.
+    """
+    logfile, fd = _create_unique(file[:-3] + '_feedback{}.txt')
+    lines = []
+    def writer(msg):
+        lines.append(msg)
+
+    writer.__dict__['file'] = logfile
+    try:
+        yield writer
+    finally:
+        lines.append('')
+        _WRITER.write(logfile, fd, '\n'.join(lines))
+
+
+def _create_unique(template):
+    """Creates the first file named template.format('') or template.format(i).
+
+    Existing names are read once from the directory rather than probed one
+    at a time. Returns the name and a file descriptor open for writing.
+    """
+    directory = os.path.dirname(template) or os.curdir
+    try:
+        existing = set(os.listdir(directory))
+    except OSError:
+        existing = set()
 
     # Ensure unique by appending an int.
     i = 0
-    while os.path.exists(logfile):
+    while True:
+        logfile = template.format(i or '')
+        if os.path.basename(logfile) not in existing:
+            try:
+                flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL
+                return logfile, os.open(logfile, flags, 0o666)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
         i += 1
-        logfile = template.format(i)
 
-    log = open(logfile, 'w+')
-    def writer(msg):
-        log.write(msg + '\n')
 
-    writer.__dict__['file'] = logfile
-    yield writer
+class FeedbackWriter(object):
+    """Writes feedback files and result records from a background thread."""
+    def __init__(self):
+        self._queue = Queue()
+        self._thread = None
+
+    def write(self, logfile, fd, text):
+        """Writes text to fd and closes it, without waiting for either.
+
+        If fd is None, logfile is opened, and replaced if it exists, by the
+        background thread. Files are written in the order given.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            # Also restarts the thread in a forked worker process.
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put((logfile, fd, text))
+
+    def flush(self):
+        """Waits until every file given to write has been written."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            logfile, fd, text = self._queue.get()
+            try:
+                if fd is None:
+                    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+                    fd = os.open(logfile, flags, 0o666)
+                written = 0
+                while written < len(text):
+                    written += os.write(fd, buffer(text, written))
+            except OSError as e:
+                print('ERROR: could not write {}: {}'.format(logfile, e),
+                      file=sys.stderr)
+            finally:
+                if fd is not None:
+                    os.close(fd)
+                self._queue.task_done()
 
-    log.close()
+_WRITER = FeedbackWriter()
+atexit.register(_WRITER.flush)
@@ -0,0 +1,199 @@
+"""Comparison of master and student values.
+
+equal is the comparison Check uses by default. close returns a check
+function that allows numbers to differ by a tolerance, for use as
+Check(expr, check=close(...)). Both work with numpy arrays, also inside
+lists, tuples and dicts, and both have a locate function that finds the
+first place where two values differ, which Tester adds to the feedback.
+"""
+from collections import namedtuple
+from itertools import izip
+import math
+import numbers
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Difference(namedtuple('Difference', ['path', 'reason', 'master', 'student'])):
+    """Where two values first differ.
+
+    path is the list of indices and keys leading to the difference. reason
+    is None if the values at path differ, or 'length', 'keys' or 'shape'
+    if their structure does, in which case master and student are the
+    lengths, the (missing, extra) keys or the shapes.
+    """
+    __slots__ = ()
+
+
+def equal(master, student):
+    """Returns True if student is the same type as master, and equal to it."""
+    if type(master) != type(student):
+        return False
+    if _is_array(master):
+        return _array_equal(master, student)
+    try:
+        return bool(master == student)
+    except ValueError:
+        # The truth value of an array is ambiguous, e.g. in a list of arrays.
+        return _equal(master, student, _exact)
+
+equal.locate = lambda master, student: locate(master, student, _exact)
+
+
+def close(rel_tol=1e-9, abs_tol=0.0):
+    """Returns a check function that allows numbers to differ slightly.
+
+    Numbers a and b, also in containers and arrays, are equal if
+    abs(a - b) <= max(rel_tol * max(abs(a), abs(b)), abs_tol). NaN is
+    equal to NaN, and infinities only to themselves. Other values are
+    compared with ==.
+    """
+    def leaf(a, b):
+        if _is_array(a) or _is_array(b):
+            a, b = numpy.asarray(a), numpy.asarray(b)
+            return a.shape == b.shape and bool(numpy.all(_array_close(a, b)))
+        if (isinstance(a, numbers.Real) and isinstance(b, numbers.Real) and
+                not isinstance(a, bool) and not isinstance(b, bool)):
+            if a == b:
+                return True
+            if math.isnan(a) or math.isnan(b):
+                return math.isnan(a) and math.isnan(b)
+            if math.isinf(a) or math.isinf(b):
+                return False  # within any relative tolerance of each other
+            return abs(a - b) <= max(rel_tol * max(abs(a), abs(b)), abs_tol)
+        return _exact(a, b)
+
+    def _array_close(a, b):
+        # numpy.isclose is asymmetric, so use the same test as for numbers.
+        # NaN compares as unequal below, without warning.
+        try:
+            with numpy.errstate(invalid='ignore'):
+                return (a == b) | (numpy.abs(a - b) <= numpy.maximum(
+                            rel_tol * numpy.maximum(numpy.abs(a), numpy.abs(b)), abs_tol)
+                        ) & numpy.isfinite(a) & numpy.isfinite(b) | (
+                            numpy.isnan(a) & numpy.isnan(b))
+        except TypeError:  # not numbers
+            return a == b
+
+    leaf.mismatches = lambda a, b: ~_array_close(a, b)
+
+    def check(master, student):
+        try:
+            if (master == student) is True:
+                return True  # the common case, at C speed
+        except ValueError:
+            pass
+        return _equal(master, student, leaf)
+
+    check.locate = lambda master, student: locate(master, student, leaf)
+    return check
+
+
+def locate(master, student, leaf=None):
+    """Returns the first Difference between master and student, or None.
+
+    Values inside lists, tuples, dicts and arrays are compared with leaf,
+    which defaults to ==.
+    """
+    leaf = leaf or _exact
+    path = []
+    while True:
+        if _is_array(master) or _is_array(student):
+            return _locate_array(path, master, student, leaf)
+
+        if _is_sequence(master) and _is_sequence(student):
+            if isinstance(master, list) != isinstance(student, list):
+                return Difference(path, None, master, student)
+            for i, (m, s) in enumerate(izip(master, student)):
+                if not _equal(m, s, leaf):
+                    path.append(i)
+                    master, student = m, s
+                    break
+            else:
+                if len(master) == len(student):
+                    return None
+                return Difference(path, 'length', len(master), len(student))
+            continue
+
+        if isinstance(master, dict) and isinstance(student, dict):
+            missing = [k for k in master if k not in student]
+            extra = [k for k in student if k not in master]
+            if missing or extra:
+                return Difference(path, 'keys', sorted(missing), sorted(extra))
+            for key, m in master.iteritems():
+                if not _equal(m, student[key], leaf):
+                    path.append(key)
+                    master, student = m, student[key]
+                    break
+            else:
+                return None
+            continue
+
+        return None if leaf(master, student) else Difference(path, None, master, student)
+
+
+def format_path(path):
+    """Returns path as indexing code, e.g. "[2]['key']"."""
+    parts = []
+    for key in path:
+        if isinstance(key, tuple):
+            parts.append('[' + ', '.join(str(i) for i in key) + ']')
+        else:
+            parts.append('[{!r}]'.format(key))
+    return ''.join(parts)
+
+
+def _equal(master, student, leaf):
+    """Compares containers item by item, and everything else with leaf."""
+    if _is_array(master) or _is_array(student):
+        return leaf(master, student)
+    if _is_sequence(master):
+        return (_is_sequence(student) and
+                isinstance(master, list) == isinstance(student, list) and
+                len(master) == len(student) and
+                all(_equal(m, s, leaf) for m, s in izip(master, student)))
+    if isinstance(master, dict):
+        return (isinstance(student, dict) and len(master) == len(student) and
+                all(k in student and _equal(m, student[k], leaf)
+                    for k, m in master.iteritems()))
+    return leaf(master, student)
+
+
+def _exact(a, b):
+    if _is_array(a) or _is_array(b):
+        return _is_array(a) and _is_array(b) and _array_equal(a, b)
+    return bool(a == b)
+
+_exact.mismatches = lambda a, b: a != b
+
+
+def _locate_array(path, master, student, leaf):
+    if not (_is_array(master) and _is_array(student)):
+        return Difference(path, None, master, student)
+    if master.shape != student.shape:
+        return Difference(path, 'shape', master.shape, student.shape)
+    mismatches = getattr(leaf, 'mismatches', None)
+    if mismatches:
+        indices = numpy.argwhere(mismatches(master, student))
+    else:
+        indices = (i for i in numpy.ndindex(*master.shape)
+                   if not leaf(master[i], student[i]))
+    for index in indices:
+        index = tuple(index)
+        return Difference(path + [index], None, master[index], student[index])
+    return None
+
+
+def _array_equal(a, b):
+    return a.shape == b.shape and bool(numpy.all(a == b))
+
+
+def _is_array(value):
+    return numpy is not None and isinstance(value, numpy.ndarray)
+
+
+def _is_sequence(value):
+    return isinstance(value, (list, tuple))
@@ -0,0 +1,186 @@
+"""A grading daemon that keeps Testers loaded between runs.
+
+`grade.py -daemon` loads test scripts as they are needed and keeps them,
+with their cached master results, in a long running process listening on
+a Unix socket. `grade.py -client file ...` sends the files to it and
+prints the messages, or with `-` the feedback itself, as they are
+written. Each request is graded in a child forked from the daemon, so
+requests do not affect each other, and the cost of a request is little
+more than that of the student code.
+
+The daemon does not notice changes to test scripts or master modules;
+restart it after editing them.
+"""
+from __future__ import print_function
+import argparse
+import errno
+import json
+import os
+import re
+import signal
+import socket
+import sys
+import traceback
+
+import command_line
+
+SOCKET = '.gradepy.sock'
+
+
+def serve(path=SOCKET, tester=None, grade_package=None):
+    """Grades the requests of clients until interrupted or terminated.
+
+    Test scripts are found as with command_line, relative to the working
+    directory of the daemon.
+    """
+    registry = command_line.TesterRegistry(tester, grade_package)
+    warm = set()
+    server = _listen(path)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    print('Grading daemon listening on ' + path, file=sys.stderr)
+    try:
+        while True:
+            _reap()
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                continue
+            try:
+                conn.settimeout(10)
+                request = _read_request(conn)
+                groups = registry.group(request['files'])
+                for tester, _ in groups:
+                    if tester not in warm:
+                        tester.warm_cache()
+                        warm.add(tester)
+                if os.fork() == 0:
+                    server.close()
+                    _grade_request(conn, request, groups)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(path)
+
+
+def submit(args, path=SOCKET):
+    """Sends args.files to the daemon at path and prints what it sends back.
+
+    Returns False if no daemon is listening at path.
+    """
+    request = {
+        'cwd': os.getcwd(),
+        'files': args.files,
+        'test': args.test and args.test.pattern,
+        'stdout': bool(args.stdout),
+        'incremental': bool(args.incremental),
+    }
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return False
+
+    try:
+        sock.sendall(json.dumps(request) + '\n')
+        sock.shutdown(socket.SHUT_WR)
+        while True:
+            data = sock.recv(1 << 16)
+            if not data:
+                break
+            sys.stdout.write(data)
+            sys.stdout.flush()
+    finally:
+        sock.close()
+    return True
+
+
+def _listen(path):
+    """Returns a socket listening at path, replacing a stale socket file."""
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except socket.error:
+            os.unlink(path)  # left behind by a daemon that was killed
+        else:
+            raise RuntimeError('A grading daemon is already listening on ' + path)
+        finally:
+            probe.close()
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o077)  # only the owner may submit
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+    server.settimeout(1)  # to reap finished children now and then
+    return server
+
+
+def _read_request(conn):
+    line = conn.makefile('rb').readline()
+    request = json.loads(line)
+    encoding = sys.getfilesystemencoding() or 'utf-8'
+    request['cwd'] = request['cwd'].encode(encoding)
+    request['files'] = [f.encode(encoding) for f in request['files']]
+    return request
+
+
+def _reap():
+    """Waits for the children that have finished."""
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except OSError as e:
+            if e.errno == errno.ECHILD:
+                return
+            raise
+        if not pid:
+            return
+
+
+def _grade_request(conn, request, groups):
+    """Grades the files of request in a forked child, sending messages to conn."""
+    status = 1
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        conn.settimeout(None)
+        def echo(msg):
+            conn.sendall(msg + '\n')
+
+        os.chdir(request['cwd'])
+        args = argparse.Namespace(
+            files=request['files'], stdout=request['stdout'],
+            test=request['test'] and re.compile(request['test']),
+            incremental=request['incremental'], jobs=1, profile=None, fork=None)
+        grouped = set(file for _, files in groups for file in files)
+        for file in request['files']:
+            if file not in grouped:
+                echo('ERROR: No testing script found for {}'.format(file))
+        for tester, files in groups:
+            for file in files:
+                command_line.grade_file(tester, file, args, echo=echo)
+        command_line._WRITER.flush()  # os._exit does not run atexit functions
+        status = 0
+    except socket.error:
+        pass  # the client went away
+    except Exception:
+        error = traceback.format_exc()
+        sys.stderr.write(error)
+        try:
+            conn.sendall(error)
+        except socket.error:
+            pass
+    finally:
+        conn.close()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
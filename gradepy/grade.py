@@ -14,14 +14,22 @@ See show_grade.py for example usage.
 """
 from __future__ import print_function
 import traceback
-import inspect
-import imp
+from itertools import izip
 import os
 import re
 import string
 import sys
-
+import time
+import tokenize
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import compare
+import timing
 import utils
+from loader import StudentLoader
 
 class Check(object):
     """Provides an interface for testing with Tester.
@@ -36,22 +44,40 @@ class Check(object):
     exceptions raised while evaluating will be caught and recordede. Both expr
     and note will be formatted with the calling scope's name space, thus they
     can include {variable_name}s.
+
+    Evaluation is stopped after time_limit seconds, and at most
+    stdout_limit characters of output are kept. Tester sets these for
+    each test function, as well as capture_fd (see utils.capture_stdout).
+    While skip is True, Checks are created without being evaluated, and
+    have skipped set to True; Tester uses this to rerun only some Checks
+    for error carried forward.
     """
+    time_limit = None
+    stdout_limit = None
+    capture_fd = False
+    skip = False
+    skipped = False
+
     def __init__(self, expr, note='', stdin=(), check=None, stdout_check=None):
         # Yes, python allows us to access the local name space of the
         # calling function (or module). This prevents us from requiring
         # the user to supply locals() as an argument.
         if not isinstance(expr, str):
             raise TypeError('Check expr must be a string.')
+        if self.skip:
+            self.skipped = True
+            self.expr, self.note, self.val, self.stdout = expr, '', None, None
+            self.seconds = 0.0
+            return
 
-        self.env = inspect.stack()[1][0].f_locals
-        self.expr = literal_format(expr, **self.env)
+        self.env = _caller_locals()
+        self.expr = _FORMATTER.format_template(expr, self.env)
         self._check = check
         self._stdout_check = stdout_check
 
         # Set note.
         if note:
-            self.note = '\n Note: ' + literal_format(note, **self.env)
+            self.note = '\n Note: ' + _FORMATTER.format_template(note, self.env)
         else:
             self.note = ''
 
@@ -64,11 +90,17 @@ class Check(object):
 
         # Evaluate expr within env.
         module_env = self.env['module'].__dict__
-        with utils.capture_stdout() as out:
+        start = time.time()
+        with utils.capture_stdout(self.stdout_limit, self.capture_fd) as out, \
+                utils.time_limit(self.time_limit) as limit:
             try:
-                self.val = eval(self.expr, module_env, self.env)
-            except Exception as e:
+                code, env = _compile_check(expr, self.expr, self.env)
+                self.val = eval(code, module_env, env)
+            except (Exception, utils.LimitExceeded) as e:
+                if isinstance(e, utils.Timeout) and e.limit is not limit:
+                    raise  # the test function's time limit
                 self.val = StudentException(e, skip=4)
+        self.seconds = time.time() - start
         if out.captured:
             self.stdout = '----begin stdout----\n' + out.captured + '\n-----end stdout-----'
         else:
@@ -76,53 +108,347 @@ class Check(object):
 
     def check(self, student_val):
         """Returns True if student_val is correct."""
-        master = self  # This function should only ever be called as master.check()
+        # This function should only ever be called as master.check()
         if not self.env['module'].__name__.startswith('master'):
             raise TestError('Attempted to call check() from the student Check.')
+        return self._check_val(student_val)
+
+    def stdout_check(self, student_stdout):
+        """Returns True if student stdout is correct."""
+        if not self.env['module'].__name__.startswith('master'):
+            raise TestError('Attempted to call stdout_check() from the student Check.')
+        return self._check_stdout(student_stdout)
 
+    def difference(self, student_val):
+        """Returns where student_val first differs from self.val, or None.
+
+        See compare.locate. Returns None if a check function without a
+        locate attribute was given.
+        """
+        locate = getattr(self._check or compare.equal, 'locate', None)
+        return locate and locate(self.val, student_val)
+
+    def _check_val(self, student_val):
+        master = self
         if self._check:
             # Use the check function provided, which may be
             # more lenient than 100% match to master.val
             return self._check(master.val, student_val)
         else:
-            return master.val == student_val and type(master.val) == type(student_val)
+            return compare.equal(master.val, student_val)
 
-    def stdout_check(self, student_stdout):
-        """Returns True if student stdout is correct."""
+    def _check_stdout(self, student_stdout):
         master = self
-        if not self.env['module'].__name__.startswith('master'):
-            raise TestError('Attempted to call stdout_check() from the student Check.')
-
         if self._stdout_check:
             return self._stdout_check(master.stdout, student_stdout)
         else:
             return master.stdout == student_stdout
 
 
+class Sweep(Check):
+    """A Check of one expression for many inputs.
+
+    Args:
+        expr (str): a python expression with a {field} for each input.
+        note (str): a note to provide in the feedback if any input fails.
+        show (int): the number of failed inputs described in the feedback.
+        inputs: sequences of values for each field, e.g. x=range(1000).
+          With several, the i-th values of each are used together.
+
+    >>> Sweep('foo({x}, {y})', x=range(100), y=range(100, 200), show=3)
+
+    A failure is reported once for the whole sweep, e.g. "failed 37/1000
+    inputs, first 5 shown". Unlike for Check, the values of fields are
+    bound to names in the expression rather than written into it, so the
+    student gets the very objects of the inputs. Other fields, like
+    {big}, are handled the same way if they are plain names.
+
+    The value of a Sweep is the list of values for each input, and its
+    stdout the list of their captured output.
+    """
+    def __init__(self, expr, note='', show=5, check=None, stdout_check=None, **inputs):
+        if not isinstance(expr, str):
+            raise TypeError('Sweep expr must be a string.')
+        if self.skip:
+            self.skipped = True
+            self.expr, self.note, self.val, self.stdout = expr, '', None, None
+            self.seconds = 0.0
+            return
+
+        self.env = _caller_locals()
+        self.template = expr
+        self.expr = expr
+        self.show = show
+        self._check = check
+        self._stdout_check = stdout_check
+        if note:
+            self.note = '\n Note: ' + _FORMATTER.format_template(note, self.env)
+        else:
+            self.note = ''
+
+        names = sorted(inputs)
+        self.cases = [dict(zip(names, values))
+                      for values in zip(*[inputs[name] for name in names])]
+        self.val = []
+        self.stdout = []
+
+        module_env = self.env['module'].__dict__
+        env = dict(self.env)
+        bound = _bound_template(expr)
+        start = time.time()
+        for case in self.cases:
+            env.update(case)
+            with utils.capture_stdout(self.stdout_limit, self.capture_fd) as out, \
+                    utils.time_limit(self.time_limit) as limit:
+                try:
+                    if bound:
+                        code = _compile(bound[0])
+                        env.update((name, env[field]) for name, field in bound[1])
+                    else:
+                        code = _compile(_FORMATTER.format_template(expr, env))
+                    self.val.append(eval(code, module_env, env))
+                except (Exception, utils.LimitExceeded) as e:
+                    if isinstance(e, utils.Timeout) and e.limit is not limit:
+                        raise  # the test function's time limit
+                    self.val.append(StudentException(e, skip=4))
+            if out.captured:
+                self.stdout.append('----begin stdout----\n' + out.captured +
+                                   '\n-----end stdout-----')
+            else:
+                self.stdout.append(None)
+        self.seconds = time.time() - start
+
+    def case_expr(self, i):
+        """Returns the expression for the i-th input, as Check would format it."""
+        return _FORMATTER.format_template(self.template, dict(self.env, **self.cases[i]))
+
+
+class CachedCheck(Check):
+    """The stored result of a master Check.
+
+    Only expr, note, val and stdout are kept. The check functions are taken
+    from the student Check it is compared to (see bind), which was created
+    by the same line of the test function.
+    """
+    def __init__(self, check):
+        self.expr = check.expr
+        self.note = check.note
+        self.val = check.val
+        self.stdout = check.stdout
+        self._check = self._stdout_check = None
+
+    def bind(self, student):
+        """Returns a copy that uses the check functions of student."""
+        bound = object.__new__(CachedCheck)
+        bound.__dict__.update(self.__dict__)
+        bound._check = student._check
+        bound._stdout_check = student._stdout_check
+        return bound
+
+    def check(self, student_val):
+        return self._check_val(student_val)
+
+    def stdout_check(self, student_stdout):
+        return self._check_stdout(student_stdout)
+
+
+class MasterCache(object):
+    """Stores master Check results, so they are computed once per Tester.
+
+    Results are keyed by test function, in the order the Checks were
+    yielded. This is only valid for deterministic test functions.
+
+    Args:
+        master_mod (module): the master module being cached.
+        path (str): if given, results are also saved to this file and
+          reused by later runs until the master module or the script
+          defining the test function changes.
+    """
+    def __init__(self, master_mod, path=None):
+        self.path = path
+        self._master_digest = utils.source_digest(master_mod)
+        self._digests = {}
+        self._results = {}
+        self._stored = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    self._stored = pickle.load(f)
+            except Exception:
+                # A stale or corrupt cache is simply rebuilt.
+                self._stored = {}
+
+    def get(self, test):
+        """Returns the cached master Checks for test, or None."""
+        key = test.__name__
+        if key not in self._results:
+            digest, checks = self._stored.get(key, (None, None))
+            if digest != self._digest(test):
+                return None
+            self._results[key] = checks
+        return self._results[key]
+
+    def put(self, test, checks):
+        self._results[test.__name__] = checks
+
+    def save(self):
+        """Writes all picklable results to self.path."""
+        if not self.path:
+            return
+        stored = dict(self._stored)
+        changed = False
+        for key, checks in self._results.items():
+            if key in stored and stored[key][1] is checks:
+                continue
+            if any(isinstance(c.val, StudentException) for c in checks):
+                continue
+            try:
+                pickle.dumps(checks, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                continue  # only cached in memory
+            stored[key] = (self._digests[key], checks)
+            changed = True
+
+        if changed:
+            # Write then rename so that parallel graders never see half a file.
+            tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp, 'wb') as f:
+                pickle.dump(stored, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self.path)
+            self._stored = stored
+
+    def _digest(self, test):
+        key = test.__name__
+        if key not in self._digests:
+            script = utils.source_digest(test)
+            self._digests[key] = self._master_digest + script
+        return self._digests[key]
+
+
 class Tester(object):
-    """A class for grading modules."""
-    def __init__(self, master_mod, points=0, note=None):
+    """A class for grading modules.
+
+    Args:
+        master_mod (module): a correct implementation of the graded module.
+        points (int): the maximum number of points, shown in the feedback.
+        note (str): a note shown at the top of the feedback.
+        cache (bool or str): if truthy, master Check results are computed
+          only once and reused for every student. If a path is given, the
+          results are also saved there for later runs. Only use this when
+          test functions are deterministic; see also register(cache=...).
+        timeout (float): default time limit in seconds for each test
+          function, and for loading the student module.
+        check_timeout (float): default time limit in seconds for
+          evaluating each student Check. Master Checks are not limited.
+          Both limits raise utils.Timeout in student code, which code
+          catching BaseException can ignore. With -fork, a child running
+          such code is stopped; only -fork-timeout bounds every
+          submission for certain.
+        sandbox (utils.Sandbox): limits on memory, CPU time and recursion
+          for student code. A breach is reported like any exception in
+          student code.
+        stdout_limit (int): the number of characters of output kept for
+          each Check. The rest is replaced by a note of how much was left
+          out. None keeps everything.
+        capture_fd (bool): if True, output written directly to file
+          descriptor 1, e.g. by C extensions or subprocesses, is also
+          captured by Checks.
+
+    Set the profiler attribute to a timing.Profiler to record how long
+    each phase of grading takes. Values in the feedback are shortened
+    with utils.summarize when they have more than max_items items or
+    max_chars characters; set these attributes to None to show them in
+    full.
+    """
+    def __init__(self, master_mod, points=0, note=None, cache=False,
+                 timeout=None, check_timeout=None, sandbox=None,
+                 stdout_limit=10**6, capture_fd=False):
         self.master_mod = master_mod
         self._adjust_modules(master_mod)
         self.log_correct = False
+        self.max_items = 1000
+        self.max_chars = 10000
         self.setup_func = None
         self.test_funcs = []
         self.points = points
         self.note = note
+        self.timeout = timeout
+        self.check_timeout = check_timeout
+        self.stdout_limit = stdout_limit
+        self.capture_fd = capture_fd
+        self.sandbox = sandbox or utils.Sandbox()
+        self.loader = StudentLoader()
         self.stdin = FakeStdin()
+        self.profiler = None
         sys.stdin = self.stdin
+        if cache:
+            path = cache if isinstance(cache, str) else None
+            self.cache = MasterCache(master_mod, path)
+        else:
+            self.cache = None
 
     def __call__(self, student_file, log_func=print, func_re=None):
-        """Runs the tests on one student submission."""
+        """Runs the tests on one student submission.
 
+        Returns a record of the results, a dict that can be stored as JSON.
+        It holds the netid, module and maximum points of the submission,
+        and for each test function and Check whether it passed, how long it
+        took, and any exception raised by student code.
+        """
+        if self.profiler:
+            self.profiler.file = student_file
+        with self._timed('submission'):
+            try:
+                if not self._start(student_file, log_func):
+                    return self.record
+
+                if func_re:
+                    self.log("Filtering test functions by regex: '{}'".format(func_re.pattern))
+                    tests = (f for f in self.test_funcs if func_re.search(f.__name__))
+                else:
+                    tests= self.test_funcs
+
+                self._run_tests(tests)
+            finally:
+                self._finish()
+        return self.record
+
+    def _timed(self, phase, test=None, check=None):
+        """Returns a context manager that times a phase of grading."""
+        if self.profiler:
+            return self.profiler.time(phase, test and test.__name__, check)
+        return timing.NOT_TIMED
+
+    def _start(self, student_file, log_func):
+        """Loads a student submission and logs the banner.
+
+        Returns False if the student module could not be loaded."""
         # This state is student specific, and is thus reset upon every call.
         self.log = log_func
+        sys.stdin = self.stdin  # there may be other Testers
         self.bad_funcs = set()
+        self.swapped = set()  # functions of ecf_mod replaced by the master's
+        if self.profiler:
+            self.profiler.file = student_file
+        path = os.path.abspath(student_file)
+        self.record = {
+            'file': student_file,
+            'netid': os.path.basename(os.path.dirname(path)),
+            'module': os.path.splitext(os.path.basename(path))[0],
+            'points': self.points,
+            'error': None,
+            'tests': [],
+        }
 
         if self.setup_func:
-            self.setup_func(student_file)
-        self.student_mod, self.ecf_mod = self._get_modules(student_file)
-        self._adjust_modules(self.student_mod, self.ecf_mod)
+            with self._timed('setup'):
+                self.setup_func(student_file)
+        with self._timed('load'):
+            load_error = self._load(student_file)
+        if not load_error:
+            with self._timed('clone'):
+                self.ecf_mod = self.loader.clone(self.student_mod, 'ecf_mod')
+            self._adjust_modules(self.student_mod, self.ecf_mod)
 
         # Banner.
         self.log('\n\n' + '=' * 70)
@@ -133,13 +459,37 @@ class Tester(object):
         if self.points:
             self.log('Maximum points: {}'.format(self.points))
 
-        if func_re:
-            self.log("Filtering test functions by regex: '{}'".format(func_re.pattern))
-            tests = (f for f in self.test_funcs if func_re.search(f.__name__))
-        else:
-            tests= self.test_funcs
+        if load_error:
+            self.record['error'] = ('Loading the student module ' + load_error).rstrip()
+            self.log('\nLoading the student module {}Cannot run tests.'
+                     .format(load_error))
+            return False
+        return True
 
-        self._run_tests(tests)
+    def _load(self, student_file):
+        """Loads the student module, and returns why it failed, if it did."""
+        try:
+            code = self.loader.compile(student_file)
+        except (SyntaxError, IOError) as e:
+            return 'failed:\n{}'.format(
+                ''.join(traceback.format_exception_only(type(e), e)))
+        try:
+            with utils.time_limit(self.timeout), self.sandbox:
+                self.student_mod = self.loader.load(student_file, 'student_mod', code)
+        except utils.Timeout as e:
+            return '{}. '.format(e)
+        except (Exception, utils.LimitExceeded) as e:
+            # Also breaches of the sandbox, which must not stop the batch.
+            below = StudentLoader.load.__func__.__code__
+            return 'raised an exception:\n{}\n'.format(StudentException(e, below=below))
+        return None
+
+    def _finish(self):
+        """Cleans up after a student submission."""
+        with self._timed('finish'):
+            if self.cache:
+                self.cache.save()
+            self.loader.release()
 
     def setup(self, every_time):
         def decorator(setup_func):
@@ -160,37 +510,28 @@ class Tester(object):
         return decorator
 
 
-    def register(self, tests=[], depends=[], manual=False):
+    def register(self, tests=[], depends=[], manual=False, cache=True,
+                 timeout=None, check_timeout=None, independent=False):
         """Decorator to mark a function as a test function of this Tester.
 
         Optionally, specifies the student functions that the function
-        with the function names as strings."""
+        with the function names as strings. Set cache=False for test
+        functions whose master results may differ between calls. timeout
+        and check_timeout override the time limits given to Tester. Set
+        independent=True if no Check depends on the side effects of
+        earlier Checks; error carried forward then only evaluates the
+        Checks that failed."""
         def decorator(test_func):
             self.test_funcs.append(test_func)
             setattr(test_func, 'tests', set(tests))
             setattr(test_func, 'depends', set(depends))
             setattr(test_func, 'manual', manual)
+            setattr(test_func, 'cache', cache)
+            setattr(test_func, 'timeout', timeout)
+            setattr(test_func, 'check_timeout', check_timeout)
+            setattr(test_func, 'independent', independent)
         return decorator
 
-    def _get_modules(self, student_file):
-        """Returns the student module and a copy for error carried forward."""
-        path = os.path.dirname(student_file)
-        mod_name = os.path.basename(student_file)[:-3]
-        sys.path.append(path)
-        try:
-            mod_junk = imp.find_module(mod_name, [path])
-        except ImportError as e:
-            if not os.path.isfile(student_file):
-                raise IOError("No such file: '{}'"
-                              .format(student_file))
-            else:
-                raise e
-        else:
-            student_mod = imp.load_module('student_mod', *mod_junk)
-            ecf_mod = imp.load_module('ecf_mod', *mod_junk)
-            assert student_mod is not ecf_mod
-            return student_mod, ecf_mod
-
     def _adjust_modules(self, *modules):
         for mod in modules:
             # Don't print the message for raw_input
@@ -216,60 +557,207 @@ class Tester(object):
             if test.__doc__:
                 self.log('"""' + test.__doc__.strip() + '"""')
 
-        if test.manual:
-            self.log('')
-            self._run_manual_test(test)
-            return
+        self._result = {'checks': [], 'error': None}
+        if ecf:
+            self.record['tests'][-1]['ecf'] = self._result
+        else:
+            self._result['name'] = test.__name__
+            self.record['tests'].append(self._result)
+        result = self._result
+        start = time.time()
+
+        Check.time_limit = test.check_timeout or self.check_timeout
+        Check.stdout_limit = self.stdout_limit
+        Check.capture_fd = self.capture_fd
+        try:
+            with self._timed('ecf' if ecf else 'test', test), \
+                    utils.time_limit(test.timeout or self.timeout):
+                if test.manual:
+                    result['manual'] = True
+                    self.log('')
+                    self._run_manual_test(test)
+                    result['seconds'] = time.time() - start
+                    return
 
-        student_mod = self.ecf_mod if ecf else self.student_mod
-        student_out = test(student_mod)
-        master_out = test(self.master_mod)
+                student_mod = self.ecf_mod if ecf else self.student_mod
+                student_out = test(student_mod)
+                if ecf:
+                    master_out, only, partial = self._ecf_plan(test)
+                else:
+                    self._first_pass = None
+                    with self._timed('master', test):
+                        master_out = list(self._master_checks(test))
+                    only, partial = None, False
+                mistakes = self._compare(master_out, student_out, test, only, partial)
+                if not ecf:
+                    self._first_pass = (master_out, mistakes)
+        except utils.Timeout as e:
+            result['error'] = 'Test function {}.'.format(e)
+            self.log('\nTest function {}. Cannot finish test.'.format(e))
+            mistakes = [True]
+        finally:
+            Check.time_limit = None
+            Check.stdout_limit = None
+            Check.capture_fd = False
+        result['passed'] = not any(mistakes)
+        result['seconds'] = time.time() - start
 
-        mistakes = self._compare(master_out, student_out)
         if any(mistakes):
             self._handle_ecf(test, ecf)
         else:
             self.log('All tests passed!')
         return mistakes
 
+    def _ecf_plan(self, test):
+        """Returns what to rerun of test for error carried forward.
+
+        That is the master Checks to compare with, the indices of the
+        Checks to evaluate (None for all), and whether the master Checks
+        stop before the end of the test function. Checks after the last
+        one that failed in the first run are not rerun, and with
+        register(independent=True) only the failed Checks are evaluated.
+        The master Checks of the first run are reused unless
+        register(cache=False) was given.
+        """
+        first_pass, self._first_pass = self._first_pass, None
+        if first_pass and test.cache:
+            master_out, mistakes = first_pass
+            # A fatal exception stops a test function early.
+            if len(mistakes) == len(master_out):
+                failed = [i for i, mistake in enumerate(mistakes) if mistake]
+                only = set(failed) if test.independent else None
+                return master_out[:failed[-1] + 1], only, failed[-1] + 1 < len(master_out)
+
+        with self._timed('master', test):
+            return list(self._master_checks(test)), None, False
+
+    def _master_checks(self, test):
+        """Returns the master Checks of test, from the cache if possible.
+
+        check_timeout is meant for student code and does not apply to them,
+        so that a slow master Check is not taken for a broken test function.
+        """
+        cached = self.cache and test.cache
+        if cached:
+            checks = self.cache.get(test)
+            if checks is not None:
+                return checks
+        time_limit, Check.time_limit = Check.time_limit, None
+        try:
+            checks = list(test(self.master_mod))
+        finally:
+            Check.time_limit = time_limit
+        if cached:
+            checks = [CachedCheck(c) for c in checks]
+            self.cache.put(test, checks)
+        return checks
+
+    def warm_cache(self):
+        """Computes the cached master Checks of every test function now.
+
+        Used before forking processes that grade submissions, so that they
+        all share the results. Nothing is done without a cache, or with a
+        setup function, which master Checks might rely on. Test functions
+        that fail on the master module are left to fail when grading.
+        """
+        if not self.cache or self.setup_func:
+            return
+        sys.stdin = self.stdin  # there may be other Testers
+        for test in self.test_funcs:
+            if test.manual or not test.cache:
+                continue
+            Check.stdout_limit = self.stdout_limit
+            Check.capture_fd = self.capture_fd
+            try:
+                with utils.time_limit(test.timeout or self.timeout):
+                    self._master_checks(test)
+            except (Exception, utils.LimitExceeded):
+                pass
+            finally:
+                Check.stdout_limit = None
+                Check.capture_fd = False
+                self.stdin.clear()
+        self.cache.save()
+
     def _run_manual_test(self, test):
         self.stdin.clear()
         try:
-            test(self.master_mod, self.student_mod)
-        except Exception as e:
+            with self.sandbox:
+                test(self.master_mod, self.student_mod)
+        except utils.Timeout:
+            raise
+        except (Exception, utils.LimitExceeded) as e:
             err = StudentException(e)
+            self._result['error'] = str(err)
             self.log('\nFatal exception in manual testing function. '
                      'Cannot finish test.\n' + str(err))
 
-    def _compare(self, master_out, student_out):
+    def _compare(self, master_out, student_out, test=None, only=None, partial=False):
+        """Compares the Checks of master_out and student_out in order.
+
+        If only is given, only Checks with those indices are evaluated and
+        compared. If partial, student_out is expected to yield more Checks
+        than master_out, and is closed after len(master_out) Checks.
+        Returns a list with True for each Check that found a mistake.
+        """
         # Compute all of master_out first so that stdin/stdout doesn't get mixed
         # between student and master.
         master_out = list(master_out)
 
         self.stdin.clear()  # don't let unused stdin bleed into this test func
         mistakes = []
-        for master in master_out:
+        for i, master in enumerate(master_out):
+            skip = _SkipChecks(only is not None and i not in only)
             try:
-                student = next(student_out)
+                with self._timed('student', test, i), self.sandbox, skip:
+                    student = next(student_out)
             except StopIteration:
                 # Test function is done with student, but wasn't done with master.
                 raise TestError('Test function yielded not enough Checks for student')
 
-            except Exception as e:
+            except utils.Timeout:
+                raise
+            except (Exception, utils.LimitExceeded) as e:
                 err = StudentException(e, skip=3)
+                self._result['error'] = str(err)
                 self.log('\nFatal exception in student code. '
                          'Cannot finish test.\n' + str(err))
+                mistakes.append(True)
                 break
             else:  # no exception
+                if student.skipped:
+                    continue  # passed in the first run
                 if isinstance(master.val, StudentException):
                     # The test function should never raise exceptions when using
                     # the master module. The test function must be broken.
                     raise TestError('Exception raised when running test function '
                                     'using master module:\n' + master.val.full_tb)
-                mistakes.append(self._compare_one(master, student))
+                if isinstance(master, CachedCheck):
+                    master = master.bind(student)
+                with self._timed('compare', test, i):
+                    if isinstance(student, Sweep):
+                        failed = self._compare_sweep(master, student)
+                        mistake = bool(failed)
+                    else:
+                        mistake = self._compare_one(master, student)
+                mistakes.append(mistake)
+                exception = student.val if isinstance(student.val, StudentException) else None
+                self._result['checks'].append({
+                    'expr': master.expr,
+                    'passed': not mistake,
+                    'seconds': student.seconds,
+                    'exception': exception and str(exception),
+                })
+                if isinstance(student, Sweep):
+                    self._result['checks'][-1].update(failed=failed, inputs=len(student.cases))
+
+        if partial:
+            student_out.close()
+            return mistakes
 
         # Test function is done with master, confirm that it is done with student.
-        foo = next(student_out, None)
+        with self.sandbox:
+            foo = next(student_out, None)
         if foo is not None:
             raise TestError('Test function yielded too many Checks for student.')
 
@@ -278,73 +766,336 @@ class Tester(object):
 
     def _compare_one(self, master, student):
         if isinstance(student.val, StudentException):
-            self.log(literal_format('\n{master.expr:q} should be {master.val}, '
-                     'but student code raised an exception:\n'
-                     '{student.val}{student.note:q}', **locals()))
+            self._feedback('\n{master.expr:q} should be {master.val}, '
+                           'but student code raised an exception:\n'
+                           '{student.val}{student.note:q}', master, student)
             return True
 
         mistake = False
 
         if not master.check(student.val):
-            self.log(literal_format('\n✘  {master.expr:q} should be {master.val}, '
-                     'but it is {student.val}{student.note:q}', **locals()))
+            self._feedback('\n✘  {master.expr:q} should be {master.val}, '
+                           'but it is {student.val}{difference:q}{student.note:q}',
+                           master, student, difference=self._difference(master, student))
             mistake = True
 
         if not master.stdout_check(student.stdout):
-            self.log(literal_format('\n✘  {master.expr:q} should print:\n{master.stdout:q}'
-                     '\n\nbut it actually prints:\n{student.stdout:q}{student.note:q}', **locals()))
+            self._feedback('\n✘  {master.expr:q} should print:\n{master.stdout:q}'
+                           '\n\nbut it actually prints:\n{student.stdout:q}{student.note:q}', master, student)
             mistake = True
 
         if self.log_correct and not mistake:
             if student.val:
-                self.log(literal_format('\n✓  {master.expr:q} is {student.val}', **locals()))
+                self._feedback('\n✓  {master.expr:q} is {student.val}', master, student)
             if student.stdout:
-                self.log(literal_format('\n✓  {master.expr:q} prints:\n{student.stdout:q}', **locals()))
+                self._feedback('\n✓  {master.expr:q} prints:\n{student.stdout:q}', master, student)
 
         return mistake
 
+    def _compare_sweep(self, master, student):
+        """Compares the values of two Sweeps for every input.
+
+        Logs a summary of the failed inputs, and returns how many failed.
+        """
+        if len(master.val) != len(student.val):
+            raise TestError('Sweep {} has {} inputs for master but {} for student.'
+                            .format(master.expr, len(master.val), len(student.val)))
+        check = master._check or compare.equal
+        stdout_check = master._stdout_check or (lambda m, s: m == s)
+
+        failures = []
+        for i, (master_val, student_val) in enumerate(izip(master.val, student.val)):
+            if isinstance(master_val, StudentException):
+                raise TestError('Exception raised when running test function '
+                                'using master module:\n' + master_val.full_tb)
+            if isinstance(student_val, StudentException):
+                fmt = '  {expr:q} should be {master_val}, but student code raised {error:q}'
+            elif not check(master_val, student_val):
+                fmt = '  {expr:q} should be {master_val}, but it is {student_val}'
+            elif not stdout_check(master.stdout[i], student.stdout[i]):
+                fmt = ('  {expr:q} should print:\n{master_stdout:q}\n\n'
+                       '  but it actually prints:\n{student_stdout:q}')
+            else:
+                continue
+            failures.append((i, fmt))
+
+        if not failures:
+            if self.log_correct:
+                self.log('\n✓  {} passed all {} inputs'.format(master.expr, len(student.val)))
+            return 0
+
+        shown = ', first {} shown:'.format(student.show) if len(failures) > student.show else ':'
+        self.log('\n✘  {} failed {}/{} inputs{}'.format(
+            master.expr, len(failures), len(student.val), shown))
+        for i, fmt in failures[:student.show]:
+            error = student.val[i]
+            if isinstance(error, StudentException):
+                error = str(error).rstrip().rsplit('\n', 1)[-1]
+            self.log(self._format(fmt, expr=student.case_expr(i),
+                                  master_val=master.val[i], student_val=student.val[i],
+                                  master_stdout=master.stdout[i], error=error,
+                                  student_stdout=student.stdout[i]))
+        if student.note:
+            self.log(student.note[1:])
+        return len(failures)
+
+    def _feedback(self, fmt, master, student, **kwargs):
+        """Logs a message about a Check."""
+        self.log(self._format(fmt, master=master, student=student, **kwargs))
+
+    def _format(self, fmt, **kwargs):
+        """Returns literal_format(fmt, **kwargs), with values shortened.
+
+        Values are shortened with utils.summarize if they have more than
+        max_items items or max_chars characters.
+        """
+        limits = None
+        if self.max_items is not None and self.max_chars is not None:
+            limits = (self.max_items, self.max_chars)
+        return _FORMATTER.format_template(fmt, kwargs, limits)
+
+    def _difference(self, master, student):
+        """Returns a message saying where student.val differs from master.val.
+
+        Returns '' if the values differ as a whole, e.g. in type.
+        """
+        diff = master.difference(student.val)
+        if not diff or not (diff.path or diff.reason):
+            return ''
+        if diff.reason == 'keys':
+            reason = 'missing' if diff.master else 'extra'
+        elif isinstance(diff.master, float) and isinstance(diff.student, float):
+            reason = 'float'  # str() of floats that differ may be the same
+        else:
+            reason = diff.reason
+        fmt = _DIFFERENCES[reason]
+        where = master.expr + compare.format_path(diff.path)
+        return self._format(fmt, where=where, diff=diff)
+
 
 
 
     def _handle_ecf(self, test, ecf):
         # See if this test benefits from ECF.
         if hasattr(test, 'depends') and not ecf:
-            bad_helpers = [f for f in test.depends if f in self.bad_funcs]
+            bad_helpers = sorted(f for f in test.depends if f in self.swapped)
             if bad_helpers:
                 self.log('Trying again with helper functions corrected.')
                 mistakes = self._run_test(test, ecf=True)
+                self._result['swapped'] = bad_helpers
                 if not any(mistakes):
                     self.log('Problem solved!')
 
-        # Fix self.ecf_mod for later tested functions.
+        self._mark_bad(test)
+
+    def _mark_bad(self, test):
+        """Fixes self.ecf_mod for functions tested by a failed test."""
         if hasattr(test, 'tests'):
             self.bad_funcs |= test.tests
-            for func_name in test.tests:
+            for func_name in test.tests - self.swapped:
                 # Update ecf module with master version of function
                 master_func = getattr(self.master_mod, func_name)
                 setattr(self.ecf_mod, func_name, master_func)
+                self.swapped.add(func_name)
+
 
 
+_DIFFERENCES = {
+    None: '\n The first difference is {where:q}, which should be {diff.master}, '
+          'but it is {diff.student}',
+    'float': '\n The first difference is {where:q}, which should be {diff.master!r:q}, '
+             'but it is {diff.student!r:q}',
+    'length': '\n {where:q} should have length {diff.master}, but it has length {diff.student}',
+    'missing': '\n {where:q} should have the keys {diff.master}',
+    'extra': '\n {where:q} should not have the keys {diff.student}',
+    'shape': '\n {where:q} should have shape {diff.master}, but it has shape {diff.student}',
+}
+
+
+class _SkipChecks(object):
+    """Sets Check.skip while in the body."""
+    def __init__(self, skip):
+        self.skip = skip
+
+    def __enter__(self):
+        Check.skip = self.skip
+
+    def __exit__(self, *exc_info):
+        Check.skip = False
+
 
 class StudentException(Exception):
     """Represents an exception that occurred in student code.
 
-    This class should always be instantiated in an except block:
+    This class should always be instantiated in an except block. The
+    first skip lines of the traceback are left out or, if below is given,
+    the frames down to the last one running the code object below.
     """
-    def __init__(self, exception, skip=1):
+    def __init__(self, exception, skip=1, below=None):
         self.exception = exception
 
-        tb = traceback.format_exc()
+        if below is None:
+            tb = traceback.format_exc()
+        else:
+            tb = _format_exc_below(below)
+        if isinstance(exception, utils.LimitExceeded):
+            # Hide the signal handler that raised the exception.
+            lines = tb.rstrip().split('\n')
+            tb = '\n'.join(lines[:-3] + lines[-1:])
         self.full_tb = tb
         self.tb = tb.split('\n', skip)[-1].rstrip()
 
     def __str__(self):
         return self.tb
 
+def _format_exc_below(code):
+    """Returns traceback.format_exc() without the frames down to code."""
+    exc_type, value, tb = sys.exc_info()
+    start = tb
+    while tb is not None:
+        if tb.tb_frame.f_code is code:
+            start = tb.tb_next
+        tb = tb.tb_next
+    return ''.join(['Traceback (most recent call last):\n'] +
+                   traceback.format_list(traceback.extract_tb(start)) +
+                   traceback.format_exception_only(exc_type, value))
+
 class TestError(Exception):
     """Indicates that something is wrong with the test script."""
 
 
+def _caller_locals(depth=2):
+    """Returns the local name space of the caller of our caller.
+
+    Unlike inspect.stack(), this does not build the whole stack or read
+    any source files, which matters because it is called for every Check.
+    """
+    return sys._getframe(depth).f_locals
+
+
+# Compiled Check expressions, shared by all Checks. Its hits and misses
+# attributes count how often an expression did not need to be compiled.
+CODE_CACHE = utils.LRUCache(1024)
+
+# Types whose values are bound as names by _compile_check. Formatting
+# them gives source code that evaluates to an equal value of the same type,
+# and _bound_template leaves out fields where a negative number, such as
+# -3 in '{n} ** 2', would not be evaluated as one value.
+_BOUND_TYPES = frozenset([str, int, bool, type(None)])
+
+_IDENTIFIER_RE = re.compile(r'[A-Za-z_]\w*$')
+
+
+def _compile_check(template, expr, env):
+    """Returns the code and local name space to evaluate a Check with.
+
+    expr is template formatted with env. If every field of template is a
+    plain name, e.g. 'add_one({quip})', and its value is a string, an int,
+    a bool or None, the template is compiled once with the fields replaced
+    by names like __gradepy_0, which are bound in a copy of env. Otherwise
+    expr itself is compiled. Both kinds of code are kept in CODE_CACHE.
+    """
+    bound = _BOUND_TEMPLATES.get(template, False)
+    if bound is False:
+        bound = _bound_template(template)
+    if bound:
+        source, names = bound
+        bindings = [(name, env[field]) for name, field in names]
+        for _, value in bindings:
+            if type(value) not in _BOUND_TYPES:
+                break
+        else:
+            env = dict(env)
+            env.update(bindings)
+            expr = source
+    return _compile(expr), env
+
+
+def _compile(expr):
+    code = CODE_CACHE.get(expr)
+    if code is None:
+        code = compile(expr, '<string>', 'eval')
+        CODE_CACHE[expr] = code
+    return code
+
+
+def _bound_template(template):
+    """Returns template with its fields replaced by names, or None.
+
+    Returns the source and a list of (name, field) pairs, one for each
+    field. Templates with format specs, conversions, attribute or item
+    lookups, fields inside string literals, or fields that _separates
+    rejects are not rewritten.
+    """
+    if len(_BOUND_TEMPLATES) >= CODE_CACHE.maxsize:
+        _BOUND_TEMPLATES.clear()
+
+    parts = []
+    names = {}
+    count = 0
+    bound = None
+    parsed = list(_FORMATTER.parse(template))
+    for i, (literal, field, spec, conversion) in enumerate(parsed):
+        parts.append(literal)
+        if field is None:
+            continue
+        if i + 1 < len(parsed):
+            following, next_field = parsed[i + 1][:2]
+        else:
+            following, next_field = '', None
+        if (spec or conversion or not _IDENTIFIER_RE.match(field) or
+                not _separates(parts[-1], following, next_field is not None)):
+            break
+        names.setdefault(field, '__gradepy_{}'.format(len(names)))
+        parts.append(names[field])
+        count += 1
+    else:
+        source = ''.join(parts)
+        if names and _count_names(source, set(names.values())) == count:
+            bound = (source, [(name, field) for field, name in names.items()])
+    _BOUND_TEMPLATES[template] = bound
+    return bound
+
+_BOUND_TEMPLATES = {}
+
+
+def _count_names(source, names):
+    """Returns how many NAME tokens of source are in names, or None.
+
+    Names inside string literals or comments are not counted. Returns None
+    if source cannot be tokenized.
+    """
+    lines = iter(source.splitlines(True))
+    try:
+        return sum(1 for token in tokenize.generate_tokens(lambda: next(lines, ''))
+                   if token[0] == tokenize.NAME and token[1] in names)
+    except (tokenize.TokenError, IndentationError):
+        return None
+
+
+def _separates(before, after, field_follows):
+    """Returns True if a field between before and after can be a name.
+
+    Its value would not be read as written if the field touched a name, a
+    number, a string or a dot, if a string literal or another field came
+    next to it (strings are concatenated), or if ** followed it (-3 ** 2
+    is -(3 ** 2)).
+    """
+    if _touches(before[-1:]) or _touches(after[:1]):
+        return False
+    before, after = before.rstrip(), after.lstrip()
+    if not after and field_follows:
+        return False
+    return not (before.endswith(_QUOTES) or after.startswith(_QUOTES) or
+                after.startswith('**'))
+
+_QUOTES = ('\'', '"')
+
+
+def _touches(char):
+    return bool(char) and (char.isalnum() or char in '_.\'"')
+
+
 def literal_format(fmt_string, **kwargs):
     """Formats strings, keeping quotations in string values.
 
@@ -355,19 +1106,64 @@ def literal_format(fmt_string, **kwargs):
 
     >>> literal_format('string: {foo:q}', foo='bar')
     "string: bar"
+
+    Each format string is only parsed the first time it is used.
     """
-    class Template(string.Formatter):
-        def format_field(self, value, spec):
-            if spec.endswith('q'):
-                spec = spec[:-1] + 's'
-            elif isinstance(value, str):
-                value = value.encode('string-escape')
-                value = "'" + value + "'"
-            return super(Template, self).format_field(value, spec)
+    return _FORMATTER.format_template(fmt_string, kwargs)
 
-    result =  Template().format(fmt_string, **kwargs)
 
-    return result
+class _LiteralFormatter(string.Formatter):
+    """The formatter of literal_format, which caches parsed format strings."""
+    max_templates = 10000
+
+    def __init__(self):
+        self._templates = {}
+
+    def format_field(self, value, spec, limits=None):
+        quote = isinstance(value, str) and not spec.endswith('q')
+        shortened = ''
+        if limits:
+            max_items, max_chars = limits
+            if isinstance(value, basestring):
+                if len(value) > max_chars:
+                    shortened = '... ({} characters)'.format(len(value))
+                    value = value[:max_chars]
+            else:
+                value = utils.summarize(value, max_items, max_chars)
+
+        if spec.endswith('q'):
+            spec = spec[:-1] + 's'
+        elif quote:
+            value = value.encode('string-escape')
+            value = "'" + value + "'"
+        return super(_LiteralFormatter, self).format_field(value, spec) + shortened
+
+    def format_template(self, fmt_string, kwargs, limits=None, recursion_depth=2):
+        # Equivalent to string.Formatter.vformat, but without parsing
+        # fmt_string again, and with values shortened to limits.
+        if recursion_depth < 0:
+            raise ValueError('Max string recursion exceeded')
+        template = self._templates.get(fmt_string)
+        if template is None:
+            template = list(self.parse(fmt_string))
+            if len(self._templates) >= self.max_templates:
+                self._templates.clear()  # e.g. format strings built at runtime
+            self._templates[fmt_string] = template
+
+        result = []
+        for literal_text, field_name, format_spec, conversion in template:
+            if literal_text:
+                result.append(literal_text)
+            if field_name is not None:
+                obj, _ = self.get_field(field_name, (), kwargs)
+                obj = self.convert_field(obj, conversion)
+                if format_spec:
+                    format_spec = self.format_template(format_spec, kwargs, limits,
+                                                       recursion_depth - 1)
+                result.append(self.format_field(obj, format_spec, limits))
+        return ''.join(result)
+
+_FORMATTER = _LiteralFormatter()
 
 
 from collections import deque
@@ -393,3 +1189,6 @@ class FakeStdin:
     def clear(self):
         self._queue.clear()
 
+    def close(self):
+        self.clear()
+
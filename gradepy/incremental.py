@@ -0,0 +1,154 @@
+"""Incremental regrading of student submissions.
+
+A manifest is kept next to each student file, recording hashes of the
+student file, the master module and every test function, along with
+whether each test function found mistakes. When a submission is graded
+again, only the test functions whose inputs changed are rerun, and their
+sections of the existing feedback file are replaced. Test functions that
+depend on a function whose test result changed are rerun as well.
+
+Grader edits to the feedback file (e.g. point deductions) are kept for
+every section that is not rerun. The result record stored with the
+feedback file is updated in the same way.
+"""
+from __future__ import print_function
+import hashlib
+import inspect
+import json
+import os
+import re
+
+import utils
+
+SECTION_RE = re.compile(r'^\n?-*\( (\w+) \)-*$', re.MULTILINE)
+
+
+def regrade(tester, student_file, func_re=None, echo=print):
+    """Grades student_file, rerunning only what changed since the last run.
+
+    Returns the path of the feedback file.
+    """
+    manifest_file = student_file[:-3] + '_manifest.json'
+    manifest = _load_manifest(manifest_file)
+    student_hash = utils.file_digest(student_file)
+    # The banner depends on the Tester's settings as well as the master.
+    banner = repr((tester.points, tester.note))
+    master_hash = hashlib.md5(utils.source_digest(tester.master_mod) + banner).hexdigest()
+    test_hashes = dict((t.__name__, _test_digest(t)) for t in tester.test_funcs)
+
+    feedback_file = manifest.get('feedback')
+    sections = {}
+    if (feedback_file and os.path.exists(feedback_file) and
+            manifest.get('student') == student_hash and
+            manifest.get('master') == master_hash):
+        with open(feedback_file) as f:
+            _, sections = split_sections(f.read())
+    old_tests = manifest.get('tests', {}) if sections else {}
+
+    def selected(test):
+        return not func_re or func_re.search(test.__name__)
+
+    def stale(test):
+        name = test.__name__
+        old = old_tests.get(name)
+        if not old or name not in sections or old['hash'] != test_hashes[name]:
+            return True
+        return bool(test.depends & changed_funcs)
+
+    changed_funcs = set()
+    if sections and not any(selected(t) and stale(t) for t in tester.test_funcs):
+        echo('Feedback is up to date: ' + feedback_file)
+        return feedback_file
+
+    lines = []
+    def log(msg):
+        lines.append(msg)
+
+    results = {}
+    rerun = []
+    try:
+        if tester._start(student_file, log):
+            for test in tester.test_funcs:
+                name = test.__name__
+                if selected(test) and stale(test):
+                    mistake = any(tester._run_test(test) or ())
+                    old = old_tests.get(name)
+                    if not old or old['mistake'] != mistake:
+                        changed_funcs |= test.tests
+                    rerun.append(name)
+                elif name in old_tests:
+                    mistake = old_tests[name]['mistake']
+                    if mistake:
+                        tester._mark_bad(test)
+                else:
+                    continue  # never graded
+                results[name] = {'hash': test_hashes[name], 'mistake': mistake}
+        else:
+            sections = {}  # the student module could not be loaded
+    finally:
+        tester._finish()
+
+    partial = bool(sections)
+    record = tester.record
+    if partial:
+        old_record = utils.read_record(feedback_file) or {'tests': []}
+        test_records = dict((r['name'], r) for r in old_record['tests'])
+        test_records.update((r['name'], r) for r in record['tests'])
+        record['tests'] = [test_records[t.__name__] for t in tester.test_funcs
+                           if t.__name__ in results and t.__name__ in test_records]
+
+    preamble, new_sections = split_sections(''.join(l + '\n' for l in lines))
+    sections.update(new_sections)
+    feedback = preamble + ''.join(sections[t.__name__] for t in tester.test_funcs
+                                  if t.__name__ in sections and t.__name__ in results)
+    if feedback_file and os.path.exists(feedback_file):
+        with open(feedback_file, 'w') as f:
+            f.write(feedback)
+        if partial:
+            echo('Regraded {} in {}'.format(', '.join(rerun), feedback_file))
+        else:
+            echo('Wrote feedback to ' + feedback_file)
+    else:
+        from command_line import logger
+        with logger(student_file) as log_func:
+            log_func(feedback[:-1])  # logger adds the final newline
+            feedback_file = log_func.file
+        echo('Wrote feedback to ' + feedback_file)
+
+    utils.write_record(feedback_file, record)
+    manifest = {'feedback': feedback_file, 'student': student_hash,
+                'master': master_hash, 'tests': results}
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return feedback_file
+
+
+def split_sections(feedback):
+    """Splits feedback into the banner and a dict of test function sections."""
+    matches = list(SECTION_RE.finditer(feedback))
+    if not matches:
+        return feedback, {}
+    preamble = feedback[:matches[0].start()]
+    ends = [m.start() for m in matches[1:]] + [len(feedback)]
+    sections = dict((m.group(1), feedback[m.start():end])
+                    for m, end in zip(matches, ends))
+    return preamble, sections
+
+
+def _test_digest(test):
+    """Returns a hash of a test function's source and registration."""
+    try:
+        source = inspect.getsource(test)
+    except (IOError, TypeError):
+        source = test.__code__.co_code
+    config = [sorted(test.tests), sorted(test.depends), test.manual,
+              test.timeout, test.check_timeout, test.independent]
+    return hashlib.md5(source + repr(config)).hexdigest()
+
+
+def _load_manifest(manifest_file):
+    try:
+        with open(manifest_file) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
@@ -0,0 +1,141 @@
+"""Loading of student modules.
+
+Student modules are compiled once and executed once per submission. The
+module used for error carried forward is a clone of the student module
+whose functions look up globals in the clone, so that replacing a
+function in the clone affects every function that calls it.
+"""
+import os
+import sys
+import types
+
+
+class StudentLoader(object):
+    """Loads student modules and cleans up after them.
+
+    Code objects are cached by path, size and modification time, so a
+    file that is graded repeatedly is only compiled once. The modules
+    and the sys.path entry added for a submission are removed again by
+    release().
+    """
+    def __init__(self):
+        self._code = {}
+        self._path = None
+        self._names = []
+        self._modules = None  # names in sys.modules before the submission
+
+    def load(self, student_file, name, code=None):
+        """Executes student_file, or its code if given, as a new module called name."""
+        if code is None:
+            code = self.compile(student_file)
+        path = os.path.abspath(os.path.dirname(student_file))
+        if self._path is None:
+            # Let the student import their own helper modules.
+            sys.path.insert(0, path)
+            self._path = path
+
+        if self._modules is None:
+            self._modules = set(sys.modules)
+        module = types.ModuleType(name)
+        module.__file__ = student_file
+        sys.modules[name] = module
+        self._names.append(name)
+        exec(code, module.__dict__)
+        return module
+
+    def compile(self, student_file):
+        """Returns the code object of student_file, compiling it if needed."""
+        try:
+            stat = os.stat(student_file)
+        except OSError:
+            raise IOError("No such file: '{}'".format(student_file))
+        key = (stat.st_size, stat.st_mtime)
+        cached = self._code.get(student_file)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        with open(student_file, 'rU') as f:
+            source = f.read()
+        code = compile(source, student_file, 'exec', dont_inherit=True)
+        self._code[student_file] = (key, code)
+        return code
+
+    def clone(self, module, name):
+        """Returns a copy of module without executing its code again.
+
+        Functions and classes defined in module are copied so that they
+        use the clone's globals. Lists, dicts and sets are copied too, so
+        that using one module does not change the state of the other, as
+        if module had been executed twice. Their items, and all other
+        values, are shared between the two modules.
+        """
+        clone = types.ModuleType(name)
+        namespace = clone.__dict__
+        copies = {}
+        for key, value in module.__dict__.items():
+            namespace[key] = _rebind(value, module, namespace, copies)
+        namespace['__name__'] = name
+        sys.modules[name] = clone
+        self._names.append(name)
+        return clone
+
+    def release(self):
+        """Removes the modules and sys.path entry of the last submission."""
+        for name in self._names:
+            sys.modules.pop(name, None)
+        self._names = []
+
+        if self._path is not None:
+            if self._path in sys.path:
+                sys.path.remove(self._path)
+            # Modules the student imported from their own directory. Those
+            # loaded before, e.g. the test script when grading runs from
+            # the student's directory, are kept.
+            prefix = self._path + os.sep
+            for name in set(sys.modules) - self._modules:
+                file = getattr(sys.modules[name], '__file__', None)
+                if file and os.path.abspath(file).startswith(prefix):
+                    del sys.modules[name]
+            self._path = None
+        self._modules = None
+
+
+def _rebind(value, module, namespace, copies):
+    """Returns a copy of value that uses namespace for its globals.
+
+    Only functions and classes defined in module, and builtin containers,
+    are copied.
+    """
+    if id(value) in copies:
+        return copies[id(value)]
+
+    if isinstance(value, types.FunctionType):
+        if value.__globals__ is not module.__dict__:
+            return value
+        copy = types.FunctionType(value.__code__, namespace, value.__name__,
+                                  value.__defaults__, value.__closure__)
+        copy.__dict__.update(value.__dict__)
+        copy.__doc__ = value.__doc__
+    elif isinstance(value, (staticmethod, classmethod)):
+        func = _rebind(value.__func__, module, namespace, copies)
+        copy = type(value)(func)
+    elif (isinstance(value, (type, types.ClassType)) and
+          getattr(value, '__module__', None) == module.__name__):
+        slots = value.__dict__.get('__slots__', ())
+        if isinstance(slots, basestring):
+            slots = (slots,)
+        skip = set(slots) | {'__dict__', '__weakref__'}
+        bases = tuple(_rebind(b, module, namespace, copies) for b in value.__bases__)
+        attrs = dict((k, _rebind(v, module, namespace, copies))
+                     for k, v in value.__dict__.items() if k not in skip)
+        try:
+            copy = type(value)(value.__name__, bases, attrs)
+        except (TypeError, ValueError):
+            return value  # e.g. an unusual metaclass; share the original
+    elif type(value) in (list, dict, set):
+        copy = type(value)(value)
+    else:
+        return value
+
+    copies[id(value)] = copy
+    return copy
@@ -1,6 +1,13 @@
+from __future__ import print_function
 import csv
+import os
 import re
-from collections import defaultdict
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import groupby, izip
+from operator import itemgetter
+
+import utils
 
 class ParseError(Exception): pass
     
@@ -11,95 +18,211 @@ TEST_FUNC_RE = re.compile(r'-{3,}\( (\w+) \)-{3,}')
 POINT_RE = re.compile(r'\(\([ ]*-([.\d]+)[ ]*\)\)')  # (( -2.5 ))
 
 
-def main(files):
-    """Creates a csv from a sequence of feedback files."""
-    scores = parse_files(files)
-    write_csv(scores)
-
-
-def parse_files(files):
-    for fname in files:
-        with open(fname) as f:
-            feedback = f.read()
-            try:
-                netid, module, points = parse_feedback(feedback)
-                yield netid, module, points, feedback
-            except ParseError:
+def main(files, modules=None, jobs=1, by_test=False):
+    """Creates a csv from a sequence of feedback files.
+
+    Students are written one at a time, so memory use does not grow with
+    the number of files. If the module columns are not given, they are
+    found by first reading the header of every file. With jobs > 1, files
+    are parsed by that many worker processes. With by_test, there is also
+    a column for each test function, holding the points deducted in its
+    section of the feedback as a negative number. The columns are then
+    found in the result records, and files without one are parsed while
+    finding them and kept in memory until they are written.
+    """
+    files = sorted(files, key=_student_key)
+    tests = []
+    parsed = {}
+    if modules is None or by_test:
+        found_modules, tests, parsed = find_columns(files, by_test, jobs)
+        modules = found_modules if modules is None else modules
+    scores = parse_files(files, jobs, parsed)
+    write_csv(scores, modules, tests)
+
+
+def parse_files(files, jobs=1, parsed=None):
+    """Yields the result of parse_file for each parsable file.
+
+    Results are yielded in the order of files, even when parsing with
+    several worker processes. Files in parsed, a dict of results of
+    parse_file, are not read again.
+    """
+    parsed = parsed or {}
+    with _imap(parse_file, [f for f in files if f not in parsed], jobs) as results:
+        for fname in files:
+            result = parsed.pop(fname) if fname in parsed else next(results)
+            if result:
+                yield result
+            else:
                 print("ERROR: could not parse file: '{}'".format(fname))
 
 
-def write_csv(scores):
-    all_scores = defaultdict(dict)
-    all_feedback = defaultdict(list)
-    all_modules = set()
-    for netid, module, points, feedback in scores:
-        all_scores[netid][module] = points
-        all_feedback[netid].append(feedback)
-        all_modules.add(module)
-
+@contextmanager
+def _imap(func, items, jobs=1):
+    """Yields an iterator of func(item) for each of items, in order.
+
+    With jobs > 1, items are processed by that many worker processes.
+    """
+    if jobs > 1 and items:
+        from multiprocessing import Pool
+        pool = Pool(jobs)
+        try:
+            yield pool.imap(func, items, chunksize=8)
+        finally:
+            pool.terminate()
+    else:
+        yield (func(item) for item in items)
+
+
+def parse_file(fname):
+    """Returns (netid, module, points, lost_by_test, feedback) or None.
+
+    See parse_feedback for the meaning of the values.
+    """
+    with open(fname) as f:
+        feedback = f.read()
+    try:
+        parsed = parse_feedback(feedback, utils.read_record(fname))
+    except ParseError:
+        return None
+    return parsed + (feedback,)
+
+
+def find_columns(files, by_test=False, jobs=1):
+    """Returns the modules graded in files, their test functions, and parses.
+
+    Modules are sorted by name. Test functions are (module, test) pairs in
+    the order they appear in the feedback, or empty unless by_test. They
+    are taken from the result records of the files. Without by_test, only
+    the header of a file without a record is read. With by_test, such a
+    file is parsed in full by one of jobs processes, and the results of
+    parse_file are returned in a dict by file name, to be reused.
+    """
+    tests = OrderedDict()
+    unrecorded = []
+    for fname in files:
+        record = utils.read_record(fname)
+        if record:
+            module_tests = tests.setdefault(record['module'], OrderedDict())
+            for test in record['tests']:
+                module_tests[test['name']] = True
+        elif by_test:
+            unrecorded.append(fname)
+        else:
+            with open(fname) as f:
+                for line in f:
+                    header = HEADER_RE.match(line)
+                    if header:
+                        tests.setdefault(header.group(2), OrderedDict())
+                        break
+
+    parsed = {}
+    with _imap(parse_file, unrecorded, jobs) as results:
+        for fname, result in izip(unrecorded, results):
+            parsed[fname] = result
+            if result:
+                module_tests = tests.setdefault(result[1], OrderedDict())
+                for test in result[3]:
+                    module_tests[test] = True
+
+    modules = sorted(tests)
+    if not by_test:
+        return modules, [], parsed
+    columns = [(module, test) for module in modules for test in tests[module]]
+    return modules, columns, parsed
+
+
+def write_csv(scores, modules, tests=()):
+    """Writes grades.csv with a row for each student.
+
+    Args:
+        scores: (netid, module, points, lost_by_test, feedback) tuples, in
+          which all tuples of one student are adjacent.
+        modules: the names of the module columns.
+        tests: (module, test) pairs, one for each test function column.
+    """
     with open('grades.csv', 'w+') as csvfile:
-        fieldnames = ['netid'] + list(all_modules) + ['feedback']
+        test_columns = [_test_column(module, test) for module, test in tests]
+        fieldnames = ['netid'] + list(modules) + test_columns + ['feedback']
         writer = csv.DictWriter(csvfile, fieldnames, escapechar='"')
         writer.writeheader()
 
-        for netid, mod_scores in all_scores.items():
-            row = mod_scores
-            row['netid'] = netid
-            feedback = '\n\n'.join(all_feedback[netid])
-            row['feedback'] = '<pre>' + feedback + '</pre>'
+        for netid, student_scores in groupby(scores, itemgetter(0)):
+            row = {'netid': netid}
+            feedback = []
+            for _, module, points, lost_by_test, module_feedback in student_scores:
+                if module not in modules:
+                    print("ERROR: no column for module '{}' of {}".format(module, netid))
+                    continue
+                row[module] = points
+                if test_columns:
+                    for test, lost in lost_by_test.items():
+                        row[_test_column(module, test)] = -lost if lost else 0
+                feedback.append(module_feedback)
+            row['feedback'] = '<pre>' + '\n\n'.join(feedback) + '</pre>'
 
             writer.writerow(row)
 
 
-def parse_feedback(feedback):
-    """Returns netid, module, and earned points based on a feedback string."""
-    lines = iter(feedback.split('\n'))
-    
-    _scan(lines, BAR_RE)
-    netid, module = HEADER_RE.match(next(lines)).groups()
-    BAR_RE.match(next(lines))
-
-    max_points = int(_scan(lines, MAX_POINTS_RE).group(1))
-    deductions = POINT_RE.finditer(''.join(feedback))
-    lost_points = sum(float(d.group(1)) for d in deductions)
-    earned_points = max_points - lost_points
-
-    return netid, module, earned_points
-
-def _scan(lines, regex):
-    for line in lines:
-        match = regex.match(line)
-        if match:
-            return match
-    raise ParseError('regex not found: ' + regex.pattern)
-
-
-# We may use these down the line if we want to split points
-# by function.
-def _lost_points(lines):
-    next_func = _scan(lines, TEST_FUNC_RE).group(1)
-    while next_func:
-        func = next_func
-        points, next_func = _parse_test_func(lines)
-        yield func, points
-
-def _parse_test_func(lines):
-    feedback, match = _take_until(lines, TEST_FUNC_RE)
-    next_func = match and match.group(1)
-    deductions = POINT_RE.finditer(''.join(feedback))
-    lost_points = sum(float(d.group(1)) for d in deductions)
-    return lost_points, next_func
-
-
-def _take_until(lines, regex):
-    taken = []
-    for line in lines:
-        match = regex.match(line)
-        if match:
-            return taken, match
-        taken.append(line)
-    return taken, None
-    #raise ParseError('regex not found: ' + regex.pattern)
+def _test_column(module, test):
+    return '{}:{}'.format(module, test)
+
+
+def _student_key(fname):
+    """Sorts feedback files such that each student's files are adjacent."""
+    # Feedback files are stored in a directory named after the netid.
+    path = os.path.abspath(fname)
+    return os.path.basename(os.path.dirname(path)), path
+
+
+def parse_feedback(feedback, record=None):
+    """Returns netid, module, earned points and points lost by test function.
+
+    Points lost by test function are an OrderedDict of the points deducted
+    in the section of each test function. The banner and point deductions
+    are found in a single pass over the lines. If the Tester record of the
+    feedback is given, netid, module and maximum points are taken from it
+    instead of the banner. Point deductions are added to the feedback by
+    graders, so they are always read from the feedback string.
+    """
+    if record:
+        netid, module, max_points = record['netid'], record['module'], record['points']
+    else:
+        netid = module = max_points = None
+    lost_points = 0
+    lost_by_test = OrderedDict()
+    test = None
+    after_bar = False
+
+    for line in feedback.split('\n'):
+        if '((' in line:
+            for d in POINT_RE.finditer(line):
+                lost_points += float(d.group(1))
+                if test:
+                    lost_by_test[test] += float(d.group(1))
+        if line.startswith('---'):
+            match = TEST_FUNC_RE.match(line)
+            if match:
+                test = match.group(1)
+                lost_by_test[test] = 0
+        elif module is None:
+            if after_bar:
+                header = HEADER_RE.match(line)
+                if not header:
+                    raise ParseError('could not find netid and module')
+                netid, module = header.groups()
+            else:
+                after_bar = bool(BAR_RE.match(line))
+        elif max_points is None:
+            match = MAX_POINTS_RE.match(line)
+            if match:
+                max_points = int(match.group(1))
+
+    if module is None:
+        raise ParseError('regex not found: ' + HEADER_RE.pattern)
+    if max_points is None:
+        raise ParseError('regex not found: ' + MAX_POINTS_RE.pattern)
+    return netid, module, max_points - lost_points, lost_by_test
 
 
 if __name__ == '__main__':
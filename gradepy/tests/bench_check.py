@@ -0,0 +1,71 @@
+"""Measures how many Checks can be created per second.
+
+Run with `python -m gradepy.tests.bench_check`. The frame lookup that
+Check used before (inspect.stack) is timed as well, for comparison, and
+so is literal_format against a formatter that parses its template on
+every call, as it used to.
+"""
+from __future__ import print_function
+import inspect
+import string
+import timeit
+
+from gradepy import grade, Check
+from gradepy.tests.example.grade_foo.master import foo
+
+N = 2000
+
+
+def make_checks(module, n=N):
+    for i in range(n):
+        Check('add_one({i})')
+
+
+def inspect_locals(depth=2):
+    return inspect.stack()[depth][0].f_locals
+
+
+def uncached_format(fmt_string, **kwargs):
+    class Template(string.Formatter):
+        def format_field(self, value, spec):
+            if spec.endswith('q'):
+                spec = spec[:-1] + 's'
+            elif isinstance(value, str):
+                value = value.encode('string-escape')
+                value = "'" + value + "'"
+            return super(Template, self).format_field(value, spec)
+    return Template().format(fmt_string, **kwargs)
+
+
+def format_feedback(module, n=N):
+    master = Check('add_one(1)')
+    for i in range(n):
+        grade.literal_format('\n{master.expr:q} should be {master.val}, '
+                             'but it is {i}{master.note:q}', **locals())
+
+
+def bench(label, func=make_checks, unit='Checks', repeat=3):
+    seconds = min(timeit.repeat(lambda: func(foo), number=1, repeat=repeat))
+    print('{:<20} {:>10.0f} {} per second'.format(label, N / seconds, unit))
+
+
+def main():
+    bench('sys._getframe')
+    fast = grade._caller_locals
+    grade._caller_locals = inspect_locals
+    try:
+        bench('inspect.stack')
+    finally:
+        grade._caller_locals = fast
+
+    bench('literal_format', format_feedback, 'messages')
+    cached = grade.literal_format
+    grade.literal_format = uncached_format
+    try:
+        bench('uncached format', format_feedback, 'messages')
+    finally:
+        grade.literal_format = cached
+
+
+if __name__ == '__main__':
+    main()
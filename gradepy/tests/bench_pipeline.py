@@ -0,0 +1,205 @@
+"""Benchmarks the grading pipeline on synthetic submissions.
+
+Run with `python -m gradepy.tests.bench_pipeline [-n N] [-seed S] ...`.
+
+N submissions of the grade_foo example are written to a temporary
+directory. Each is a copy of the master module with some mistakes, chosen
+at random with the given rates:
+
+    -fail    Foo.bar and divide are wrong
+    -ecf     add_one is wrong, which triggers error carried forward in
+             test_add_two
+    -print   cook_stdin prints its result instead of returning it
+
+The test script makes -checks Checks per test function, and test_stdin
+feeds -lines lines of stdin to a single Check, each of which is echoed
+to stdout.
+
+Three stages are timed: Tester.__call__ (feedback discarded), run_tests
+(feedback files written, optionally with -jobs workers) and makecsv.main
+on the resulting feedback files. For each stage, throughput, latency per
+Check and the peak resident memory of the process so far are printed.
+"""
+from __future__ import print_function
+import argparse
+import imp
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from gradepy import Tester, Check, makecsv
+from gradepy.command_line import run_tests
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'example')
+MASTER = os.path.join(EXAMPLE, 'grade_foo', 'master', 'foo.py')
+
+MISTAKES = {
+    'fail': [('self.arg *= 3', 'self.arg *= 2'),
+             ('return x / float(y)', 'return x / y')],
+    'ecf': [('return x + 1', 'return x + 1 if x != 100 else None')],
+    'print': [('return meatmap[animal]', 'print(meatmap[animal])')],
+}
+
+
+def make_tester(checks, lines):
+    # Check.check requires the master module's name to start with 'master'.
+    master = imp.load_source('master_foo', MASTER)
+    tester = Tester(master, points=100, note='Synthetic benchmark submission.')
+
+    @tester.register(tests=['add_one'])
+    def test_add_one(module):
+        for i in range(90, 90 + checks):
+            yield Check('add_one({i})')
+        yield Check("add_one('one')")
+
+    @tester.register(tests=['divide'])
+    def test_divide(module):
+        for i in range(1, checks + 1):
+            yield Check('divide({i}, 2)')
+
+    @tester.register(tests=['Foo'])
+    def test_foo(module):
+        foo = module.Foo('2')
+        for i in range(min(checks, 5)):
+            yield Check('foo.arg', note='after calling foo.bar() {i} times')
+            foo.bar()
+
+    @tester.register(tests=['add_two'], depends=['add_one'])
+    def test_add_two(module):
+        for i in range(95, 95 + checks):
+            yield Check('add_two({i})')
+
+    @tester.register(tests=['cook_stdin'])
+    def test_stdin(module):
+        animals = ['pig', 'cow'] * (lines // 2)
+        yield Check('[cook_stdin() for _ in range({n})]'.format(n=len(animals)),
+                    stdin=animals)
+        yield Check('cook_stdin()', stdin='cow')
+
+    return tester
+
+
+def make_submissions(directory, n, rates, seed):
+    """Writes n student directories to directory and returns the files."""
+    rng = random.Random(seed)
+    with open(MASTER) as f:
+        master = f.read()
+
+    files = []
+    for i in range(n):
+        source = master
+        for kind, rate in sorted(rates.items()):
+            if rng.random() < rate:
+                for old, new in MISTAKES[kind]:
+                    source = source.replace(old, new)
+        student_dir = os.path.join(directory, 'st{:05d}'.format(i))
+        os.mkdir(student_dir)
+        student_file = os.path.join(student_dir, 'foo.py')
+        with open(student_file, 'w') as f:
+            f.write(source)
+        files.append(student_file)
+    return files
+
+
+def peak_memory():
+    """Returns the peak resident memory of this process and its children in MB."""
+    usage = [resource.getrusage(who).ru_maxrss
+             for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return max(usage) / 1024.0  # ru_maxrss is in KB on Linux
+
+
+def report(stage, seconds, n, checks=None):
+    line = '{:<16} {:>8.2f} s {:>10.1f} subs/s'.format(stage, seconds, n / seconds)
+    if checks:
+        line += ' {:>10.1f} us/Check'.format(1e6 * seconds / checks)
+    print(line + ' {:>8.1f} MB peak'.format(peak_memory()))
+
+
+def bench_tester(tester, files):
+    """Grades every file with Tester.__call__, discarding the feedback."""
+    n_checks = 0
+    check_seconds = []
+    start = time.time()
+    for file in files:
+        record = tester(file, log_func=lambda msg: None)
+        for test in record['tests']:
+            for result in [test] + ([test['ecf']] if 'ecf' in test else []):
+                n_checks += len(result['checks'])
+                check_seconds.extend(c['seconds'] for c in result['checks'])
+    report('Tester.__call__', time.time() - start, len(files), n_checks)
+
+    check_seconds.sort()
+    if check_seconds:
+        print('{:<16} p50 {:.1f} us, p95 {:.1f} us, max {:.1f} us (student eval only)'.format(
+            '', *[1e6 * check_seconds[int(q * (len(check_seconds) - 1))]
+                  for q in (0.5, 0.95, 1)]))
+    return n_checks
+
+
+def bench_run_tests(tester, files, jobs, n_checks):
+    args = argparse.Namespace(files=files, test=None, stdout=False, jobs=jobs,
+                              incremental=False, profile=None)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')  # 'Wrote feedback to ...'
+    start = time.time()
+    try:
+        run_tests(args, tester)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    report('run_tests', time.time() - start, len(files), n_checks)
+
+
+def bench_makecsv(directory, files, jobs):
+    feedback = [f[:-3] + '_feedback.txt' for f in files]
+    cwd = os.getcwd()
+    os.chdir(directory)  # grades.csv is written to the working directory
+    start = time.time()
+    try:
+        makecsv.main(feedback, jobs=jobs, by_test=True)
+    finally:
+        os.chdir(cwd)
+    report('makecsv.main', time.time() - start, len(files))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', type=int, default=200, help='number of submissions')
+    parser.add_argument('-seed', type=int, default=0)
+    parser.add_argument('-fail', type=float, default=0.5)
+    parser.add_argument('-ecf', type=float, default=0.3)
+    parser.add_argument('-print', type=float, default=0.2)
+    parser.add_argument('-checks', type=int, default=20,
+                        help='Checks per test function')
+    parser.add_argument('-lines', type=int, default=200,
+                        help='lines of stdin for test_stdin')
+    parser.add_argument('-jobs', type=int, default=1)
+    parser.add_argument('-keep', action='store_true',
+                        help='keep the temporary directory')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='gradepy_bench_')
+    try:
+        rates = {'fail': args.fail, 'ecf': args.ecf, 'print': args.print}
+        files = make_submissions(directory, args.n, rates, args.seed)
+        tester = make_tester(args.checks, args.lines)
+        stdin = sys.stdin
+        try:
+            n_checks = bench_tester(tester, files)
+            bench_run_tests(tester, files, args.jobs, n_checks)
+        finally:
+            sys.stdin = stdin
+        bench_makecsv(directory, files, args.jobs)
+    finally:
+        if args.keep:
+            print('Submissions and feedback kept in ' + directory)
+        else:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
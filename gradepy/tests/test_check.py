@@ -0,0 +1,51 @@
+"""Tests of how Check expressions are compiled.
+
+Run with `python -m unittest gradepy.tests.test_check`.
+"""
+import unittest
+
+from gradepy.grade import _FORMATTER, _bound_template, _compile_check
+
+
+class CompileCheckTest(unittest.TestCase):
+    def evaluate(self, template, **env):
+        """Returns template evaluated as bound and as formatted text."""
+        expr = _FORMATTER.format_template(template, env)
+        code, bound_env = _compile_check(template, expr, env)
+        return eval(code, {}, bound_env), eval(expr, {}, dict(env))
+
+    def assertSameValue(self, template, **env):
+        bound, text = self.evaluate(template, **env)
+        self.assertEqual((type(bound), bound), (type(text), text), template)
+
+    def test_binds_plain_fields(self):
+        self.assertEqual(_bound_template('max({a}, {b})')[0],
+                         'max(__gradepy_0, __gradepy_1)')
+        self.assertIsNotNone(_bound_template('{n} + 1'))
+        self.assertIsNotNone(_bound_template('1 + {n}'))
+        self.assertIsNotNone(_bound_template('{x} in "abc"'))
+
+    def test_does_not_bind(self):
+        for template in ['{n} ** 2', '1 + {n}**2', 'a{n}', '{n}.real',
+                         '"a {n} b"', '{s} "x"', '"x" {s}', '{a} {b}',
+                         '{n:d}', '{n!r}', '{n[0]}']:
+            self.assertIsNone(_bound_template(template), template)
+
+    def test_same_value_as_text(self):
+        for n in [-3, 0, 3, True]:
+            for template in ['{n}', '-{n}', '1 + {n} ** 2', 'pow(2, {n} ** 2)',
+                             '2 ** {n}', '[{n}, -{n}]', '{n} * 2', 'abs({n})']:
+                self.assertSameValue(template, n=n)
+        for s in ['', 'a b', "it's", 'x"y', '\n']:
+            for template in ['{s}', '{s} + "!"', '{s} "!"', '"!" {s}',
+                             '[{s}, "{{s}}"]', '{s} in "a b c"', '{s} * 2']:
+                self.assertSameValue(template, s=s)
+        self.assertSameValue('{x} is None', x=None)
+
+    def test_unbound_values_are_written(self):
+        bound, text = self.evaluate('{xs} + [1]', xs=[-1.5])
+        self.assertEqual(bound, [-1.5, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+"""Tests of the comparison of master and student values.
+
+Run with `python -m unittest gradepy.tests.test_compare`.
+"""
+import unittest
+import warnings
+
+from gradepy.compare import Difference, close, equal, format_path, locate
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+needs_numpy = unittest.skipIf(numpy is None, 'numpy is not installed')
+
+
+class EqualTest(unittest.TestCase):
+    def test_same_type_and_value(self):
+        self.assertTrue(equal(3, 3))
+        self.assertTrue(equal([1, (2, 'a')], [1, (2, 'a')]))
+        self.assertTrue(equal({'a': [1], 'b': 2}, {'b': 2, 'a': [1]}))
+
+    def test_type_must_match(self):
+        self.assertFalse(equal(1, 1.0))
+        self.assertFalse(equal([1, 2], (1, 2)))
+        self.assertFalse(equal(True, 1))
+
+    def test_different_values(self):
+        self.assertFalse(equal([1, 2], [1, 3]))
+        self.assertFalse(equal([1, 2], [1, 2, 3]))
+        self.assertFalse(equal({'a': 1}, {'b': 1}))
+
+    def test_locate_in_containers(self):
+        self.assertIsNone(equal.locate([1, {'a': 2}], [1, {'a': 2}]))
+        self.assertEqual(equal.locate([1, {'a': [2, 3]}], [1, {'a': [2, 4]}]),
+                         Difference([1, 'a', 1], None, 3, 4))
+
+    def test_locate_tuple_against_list(self):
+        self.assertEqual(equal.locate([(1, 2)], [[1, 2]]),
+                         Difference([0], None, (1, 2), [1, 2]))
+
+
+class CloseTest(unittest.TestCase):
+    def test_tolerances(self):
+        check = close(rel_tol=1e-3)
+        self.assertTrue(check(1000.0, 1000.5))
+        self.assertFalse(check(1000.0, 1002.0))
+        self.assertTrue(close(abs_tol=0.1)(0.0, 0.05))
+        self.assertFalse(close()(0.0, 1e-12))
+
+    def test_in_containers(self):
+        check = close(abs_tol=0.01)
+        self.assertTrue(check([1.0, (2.0, {'a': 3.0})], [1.001, (2.0, {'a': 2.999})]))
+        self.assertFalse(check([1.0, 2.0], [1.0, 2.1]))
+        self.assertFalse(check({'a': 1.0}, {'b': 1.0}))
+
+    def test_nan(self):
+        nan = float('nan')
+        self.assertTrue(close()([nan, 1.0], [nan, 1.0]))
+        self.assertFalse(close()(nan, 1.0))
+        self.assertFalse(close()(1.0, nan))
+
+    def test_infinity(self):
+        inf = float('inf')
+        self.assertTrue(close(rel_tol=0.1)([1.0, inf], [1.0, inf]))
+        self.assertFalse(close(rel_tol=0.1)(inf, -inf))
+        self.assertFalse(close(rel_tol=0.1)(1.0, inf))
+
+    def test_other_values_exact(self):
+        check = close(abs_tol=1)
+        self.assertTrue(check(['a', None], ['a', None]))
+        self.assertFalse(check('a', 'b'))
+        self.assertFalse(check(True, 1.5))
+
+    def test_locate(self):
+        check = close(abs_tol=0.01)
+        self.assertIsNone(check.locate([1.0, 2.0], [1.0, 2.001]))
+        self.assertEqual(check.locate({'x': [1.0, 2.0]}, {'x': [1.0, 2.5]}),
+                         Difference(['x', 1], None, 2.0, 2.5))
+
+
+class LocateTest(unittest.TestCase):
+    def test_equal(self):
+        self.assertIsNone(locate([1, [2, 3]], [1, [2, 3]]))
+
+    def test_length_mismatch(self):
+        self.assertEqual(locate([[1, 2, 3]], [[1, 2]]),
+                         Difference([0], 'length', 3, 2))
+
+    def test_first_difference_before_length(self):
+        self.assertEqual(locate([1, 2, 3], [1, 5]),
+                         Difference([1], None, 2, 5))
+
+    def test_key_mismatch(self):
+        self.assertEqual(locate({'a': 1, 'b': 2}, {'b': 2, 'c': 3}),
+                         Difference([], 'keys', ['a'], ['c']))
+
+    def test_type_mismatch(self):
+        self.assertEqual(locate([1, 2], 'ab'), Difference([], None, [1, 2], 'ab'))
+
+
+class FormatPathTest(unittest.TestCase):
+    def test_format(self):
+        self.assertEqual(format_path([]), '')
+        self.assertEqual(format_path([2, 'key']), "[2]['key']")
+        self.assertEqual(format_path([0, (1, 2)]), '[0][1, 2]')
+
+
+@needs_numpy
+class NumpyTest(unittest.TestCase):
+    def test_equal(self):
+        a = numpy.arange(6).reshape(2, 3)
+        self.assertTrue(equal(a, a.copy()))
+        self.assertFalse(equal(a, a + 1))
+        self.assertFalse(equal(a, a.reshape(3, 2)))
+        self.assertTrue(equal([a, 1], [a.copy(), 1]))
+        self.assertFalse(equal([a, 1], [a + 1, 1]))
+
+    def test_close(self):
+        a = numpy.array([1.0, 2.0, numpy.nan])
+        check = close(abs_tol=0.01)
+        self.assertTrue(check(a, a + 0.001))
+        self.assertFalse(check(a, a + 1))
+        self.assertFalse(check(a, numpy.array([1.0, 2.0])))
+
+    def test_close_nan_does_not_warn(self):
+        a = numpy.array([1.0, numpy.nan, numpy.inf])
+        b = numpy.array([1.0, 2.0, numpy.inf])
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            self.assertTrue(close()(a, a.copy()))
+            self.assertFalse(close()(a, b))
+            self.assertFalse(close(rel_tol=0.1)(a[2:], -a[2:]))
+            self.assertEqual(close().locate(a, b)[:2], ([(1,)], None))
+
+    def test_locate_shape(self):
+        self.assertEqual(locate([numpy.zeros((2, 3))], [numpy.zeros(3)]),
+                         Difference([0], 'shape', (2, 3), (3,)))
+
+    def test_locate_index(self):
+        a = numpy.zeros((2, 3))
+        b = a.copy()
+        b[1, 2] = 5
+        difference = equal.locate({'a': a}, {'a': b})
+        self.assertEqual(difference.path, ['a', (1, 2)])
+        self.assertEqual(format_path(difference.path), "['a'][1, 2]")
+        self.assertEqual((difference.master, difference.student), (0, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+"""Tests of incremental regrading.
+
+Run with `python -m unittest gradepy.tests.test_incremental`.
+"""
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from gradepy import Tester, incremental
+from gradepy.command_line import _WRITER
+
+MASTER = '''
+def inc(x):
+    return x + 1
+
+def double(x):
+    return 2 * x
+
+def name():
+    return 'master'
+'''
+
+STUDENT = '''
+def inc(x):
+    return x + 1 if x < 5 else x
+
+def double(x):
+    return inc(x) + inc(x) - 2
+
+def name():
+    return 'student'
+'''
+
+# {inc} is replaced by the argument test_inc checks, to change its source.
+SCRIPT = '''
+from gradepy import Check
+
+def register(tester):
+    @tester.register(tests=['inc'])
+    def test_inc(module):
+        yield Check('inc({inc})')
+
+    @tester.register(tests=['double'], depends=['inc'])
+    def test_double(module):
+        yield Check('double(5)')
+
+    @tester.register(tests=['name'])
+    def test_name(module):
+        yield Check('name()')
+'''
+
+
+class RegradeTest(unittest.TestCase):
+    def setUp(self):
+        self.stdin = sys.stdin
+        self.dir = tempfile.mkdtemp(prefix='gradepy_test_')
+        self.student = self._write(os.path.join('abc123', 'foo.py'), STUDENT)
+        self.master = imp.load_source('master_foo', self._write('master_foo.py', MASTER))
+        self.versions = 0
+
+    def tearDown(self):
+        sys.stdin = self.stdin
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, text):
+        path = os.path.join(self.dir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def regrade(self, inc=1):
+        """Regrades the student with a test script checking inc(inc)."""
+        self.versions += 1  # a new script file, so inspect sees the source
+        name = 'script{}'.format(self.versions)
+        path = self._write(name + '.py', SCRIPT.replace('{inc}', str(inc)))
+        tester = Tester(self.master)
+        imp.load_source(name, path).register(tester)
+
+        messages = []
+        feedback_file = incremental.regrade(tester, self.student, echo=messages.append)
+        _WRITER.flush()
+        return feedback_file, messages
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def add_deduction(self, path, test, points):
+        """Adds a grader's deduction to the section of test."""
+        feedback = self.read(path)
+        header = '( {} )'.format(test)
+        start = feedback.index(header)
+        end = feedback.index('\n', start)
+        feedback = '{}\n(( -{} ))\n{}'.format(feedback[:end], points, feedback[end + 1:])
+        with open(path, 'w') as f:
+            f.write(feedback)
+
+    def sections(self, path):
+        return incremental.split_sections(self.read(path))[1]
+
+    def test_first_run_writes_feedback_and_manifest(self):
+        feedback_file, messages = self.regrade()
+        self.assertEqual(messages, ['Wrote feedback to ' + feedback_file])
+        self.assertEqual(sorted(self.sections(feedback_file)),
+                         ['test_double', 'test_inc', 'test_name'])
+        self.assertTrue(os.path.exists(self.student[:-3] + '_manifest.json'))
+
+    def test_unchanged_run_is_skipped(self):
+        feedback_file, _ = self.regrade()
+        self.add_deduction(feedback_file, 'test_name', 2)
+        before = self.read(feedback_file)
+
+        _, messages = self.regrade()
+        self.assertEqual(messages, ['Feedback is up to date: ' + feedback_file])
+        self.assertEqual(self.read(feedback_file), before)
+
+    def test_changed_test_replaces_only_its_section(self):
+        feedback_file, _ = self.regrade(inc=1)
+        self.add_deduction(feedback_file, 'test_inc', 1)
+        self.add_deduction(feedback_file, 'test_name', 2)
+        old = self.sections(feedback_file)
+
+        # inc(2) passes like inc(1), so nothing depending on inc is rerun.
+        _, messages = self.regrade(inc=2)
+        self.assertEqual(messages, ['Regraded test_inc in ' + feedback_file])
+        new = self.sections(feedback_file)
+        self.assertNotIn('(( -1 ))', new['test_inc'])
+        self.assertEqual(new['test_name'], old['test_name'])
+        self.assertIn('(( -2 ))', new['test_name'])
+        self.assertEqual(new['test_double'], old['test_double'])
+
+    def test_dependents_rerun_when_result_flips(self):
+        feedback_file, _ = self.regrade(inc=1)
+        self.add_deduction(feedback_file, 'test_double', 1)
+        self.add_deduction(feedback_file, 'test_name', 2)
+        self.assertNotIn('should be', self.sections(feedback_file)['test_inc'])
+
+        # inc(7) fails, so test_double is rerun with error carried forward.
+        _, messages = self.regrade(inc=7)
+        self.assertEqual(messages, ['Regraded test_inc, test_double in ' + feedback_file])
+        new = self.sections(feedback_file)
+        self.assertIn('inc(7) should be 8, but it is 7', new['test_inc'])
+        self.assertNotIn('(( -1 ))', new['test_double'])
+        self.assertIn('(( -2 ))', new['test_name'])
+        self.assertIn('Trying again with helper functions corrected.', new['test_double'])
+
+
+if __name__ == '__main__':
+    unittest.main()
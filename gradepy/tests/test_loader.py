@@ -0,0 +1,98 @@
+"""Tests of loading and releasing student modules.
+
+Run with `python -m unittest gradepy.tests.test_loader`.
+"""
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from gradepy import Tester
+from gradepy.loader import StudentLoader
+
+
+class ReleaseTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='gradepy_test_')
+        self._write('foo.py', 'import foo_helper\n')
+        self._write('foo_helper.py', 'Y = 2\n')
+        self._write('grade_foo_script.py', 'X = 1\n')
+        self.loader = StudentLoader()
+
+    def tearDown(self):
+        self.loader.release()
+        for name in ['foo_helper', 'grade_foo_script']:
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, text):
+        with open(os.path.join(self.dir, name), 'w') as f:
+            f.write(text)
+
+    def test_removes_modules_of_the_submission(self):
+        self.loader.load(os.path.join(self.dir, 'foo.py'), 'student_mod')
+        self.assertIn('foo_helper', sys.modules)
+        self.loader.release()
+        self.assertNotIn('student_mod', sys.modules)
+        self.assertNotIn('foo_helper', sys.modules)
+        self.assertNotIn(self.dir, sys.path)
+
+    def test_keeps_modules_loaded_before_from_the_same_directory(self):
+        # As when grading runs from the directory of the submission.
+        sys.path.insert(0, self.dir)
+        try:
+            import grade_foo_script
+        finally:
+            sys.path.remove(self.dir)
+        self.loader.load(os.path.join(self.dir, 'foo.py'), 'student_mod')
+        self.loader.release()
+        self.assertIs(sys.modules['grade_foo_script'], grade_foo_script)
+        self.assertIn('__main__', sys.modules)
+        self.assertNotIn('foo_helper', sys.modules)
+
+
+class LoadErrorTest(unittest.TestCase):
+    def setUp(self):
+        self.stdin = sys.stdin
+        self.dir = tempfile.mkdtemp(prefix='gradepy_test_')
+        path = os.path.join(self.dir, 'master_foo.py')
+        with open(path, 'w') as f:
+            f.write('X = 1\n')
+        self.tester = Tester(imp.load_source('master_foo', path))
+
+    def tearDown(self):
+        sys.stdin = self.stdin
+        shutil.rmtree(self.dir)
+
+    def error(self, source):
+        """Returns the recorded error of grading source, or of a missing file."""
+        path = os.path.join(self.dir, 'foo.py')
+        if source is not None:
+            with open(path, 'w') as f:
+                f.write(source)
+        return self.tester(path, log_func=lambda msg: None)['error']
+
+    def test_syntax_error(self):
+        error = self.error('def f(:\n    pass\n')
+        self.assertTrue(error.startswith('Loading the student module failed:\n'))
+        self.assertIn('SyntaxError', error)
+        self.assertNotIn('loader.py', error)
+
+    def test_missing_file(self):
+        error = self.error(None)
+        self.assertIn('IOError: No such file', error)
+        self.assertNotIn('loader.py', error)
+
+    def test_exception_shows_only_student_frames(self):
+        error = self.error('def f():\n    return 1 / 0\nf()\n')
+        self.assertEqual(error.split('\n')[:2], [
+            'Loading the student module raised an exception:',
+            '  File "{}", line 3, in <module>'.format(os.path.join(self.dir, 'foo.py'))])
+        self.assertIn('ZeroDivisionError', error)
+        self.assertNotIn('loader.py', error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""Timing instrumentation for grading runs.
+
+A Profiler attached to a Tester records the wall and CPU time of each
+phase of grading: loading the student module, running the master and
+student sides of each Check, comparing and formatting results, and ECF
+retries. The events can be summarized as a table or written as a trace
+with one JSON object per line.
+"""
+from __future__ import print_function
+import json
+import time
+from collections import defaultdict
+
+cpu_time = getattr(time, 'process_time', time.clock)
+
+
+class Profiler(object):
+    """Records the time taken by each phase of grading.
+
+    Every event is a dict with the keys file, phase, test, check, wall and
+    cpu. test and check (the index of the Check in the test function) are
+    None for phases that are not specific to one.
+    """
+    def __init__(self):
+        self.events = []
+        self.file = None
+
+    def time(self, phase, test=None, check=None):
+        """Returns a context manager that records the time of its body."""
+        return _Timer(self, phase, test, check)
+
+    def take(self):
+        """Returns and forgets all recorded events."""
+        events, self.events = self.events, []
+        return events
+
+    def write_trace(self, path):
+        with open(path, 'w') as f:
+            for event in self.events:
+                f.write(json.dumps(event, sort_keys=True) + '\n')
+
+    def summary(self, top=10):
+        """Returns a table of total times by phase, test function and file."""
+        lines = ['{:<24} {:>8} {:>10} {:>10} {:>10}'.format(
+                 'phase', 'count', 'wall (s)', 'cpu (s)', 'max (s)')]
+        for phase, events in sorted(self._group('phase').items()):
+            walls = [e['wall'] for e in events]
+            lines.append('{:<24} {:>8} {:>10.3f} {:>10.3f} {:>10.4f}'.format(
+                phase, len(events), sum(walls), sum(e['cpu'] for e in events),
+                max(walls)))
+
+        for key, title in [('test', 'Slowest test functions'),
+                           ('file', 'Slowest submissions')]:
+            phase = 'test' if key == 'test' else 'submission'
+            totals = defaultdict(float)
+            for event in self.events:
+                if event['phase'] == phase:
+                    totals[event[key]] += event['wall']
+            slowest = sorted(totals.items(), key=lambda x: -x[1])[:top]
+            if slowest:
+                lines.append('\n' + title + ':')
+                lines.extend('{:>10.3f}  {}'.format(wall, name) for name, wall in slowest)
+        return '\n'.join(lines)
+
+    def _group(self, key):
+        groups = defaultdict(list)
+        for event in self.events:
+            groups[event[key]].append(event)
+        return groups
+
+
+class _Timer(object):
+    def __init__(self, profiler, phase, test, check):
+        self.profiler = profiler
+        self.event = {'file': profiler.file, 'phase': phase,
+                      'test': test, 'check': check}
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.cpu = cpu_time()
+
+    def __exit__(self, *exc_info):
+        self.event['wall'] = time.time() - self.wall
+        self.event['cpu'] = cpu_time() - self.cpu
+        self.profiler.events.append(self.event)
+
+
+class _NotTimed(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+NOT_TIMED = _NotTimed()
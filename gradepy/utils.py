@@ -1,7 +1,187 @@
+import hashlib
+import inspect
+import json
+import math
+import os
+import signal
 import sys
+import threading
+import time
 from contextlib import contextmanager
 from cStringIO import StringIO
 
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import ctypes
+    _libc = ctypes.CDLL(None)
+except (ImportError, OSError):
+    _libc = None
+
+
+class LimitExceeded(BaseException):
+    """Raised by a signal handler when code exceeds a limit.
+
+    Like KeyboardInterrupt, it is not caught by `except Exception`, so
+    that student code cannot easily swallow it.
+    """
+
+
+class Timeout(LimitExceeded):
+    """Raised in code that runs longer than a time_limit."""
+    def __init__(self, seconds, limit=None):
+        super(Timeout, self).__init__(
+            'exceeded the time limit of {} seconds'.format(seconds))
+        self.seconds = seconds
+        self.limit = limit
+
+def file_digest(path):
+    """Returns the md5 hex digest of a file's contents."""
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def source_digest(obj):
+    """Returns the md5 hex digest of the file defining a module or function."""
+    return file_digest(inspect.getsourcefile(obj) or inspect.getfile(obj))
+
+
+def record_file(feedback_file):
+    """Returns the path of the result record stored with a feedback file."""
+    return os.path.splitext(feedback_file)[0] + '.json'
+
+
+def write_record(feedback_file, record):
+    """Stores the record returned by Tester next to its feedback file."""
+    with open(record_file(feedback_file), 'w') as f:
+        f.write(format_record(record))
+
+
+def format_record(record):
+    """Returns the contents of the file write_record stores record in."""
+    return json.dumps(record, sort_keys=True) + '\n'
+
+
+def read_record(feedback_file):
+    """Returns the record stored with a feedback file, or None."""
+    try:
+        with open(record_file(feedback_file)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+class LRUCache(object):
+    """A mapping that keeps only the maxsize most recently used items.
+
+    Lookups with get() are counted in the hits and misses attributes.
+    When the cache is full, the least recently used quarter of it is
+    dropped at once, so that lookups only need to note when they happen.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = {}
+        self._used = {}
+        self._clock = 0
+
+    def get(self, key, default=None):
+        if key not in self._items:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._clock += 1
+        self._used[key] = self._clock
+        return self._items[key]
+
+    def __setitem__(self, key, value):
+        self._items[key] = value
+        self._clock += 1
+        self._used[key] = self._clock
+        if len(self._items) > self.maxsize:
+            by_use = sorted(self._used, key=self._used.get)
+            for old in by_use[:len(by_use) - self.maxsize * 3 // 4]:
+                del self._items[old]
+                del self._used[old]
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        self._items.clear()
+        self._used.clear()
+
+
+# Brackets of the containers that summarize can shorten.
+_CONTAINERS = {list: ('[', ']'), tuple: ('(', ')'), dict: ('{', '}'),
+               set: ('set([', '])'), frozenset: ('frozenset([', '])')}
+
+
+def summarize(value, max_items=1000, max_chars=10000):
+    """Returns value, or a shortened str of it if value is large.
+
+    Lists, tuples, dicts and sets are large if they have more than
+    max_items items, contain a large value, or contain a string longer
+    than max_chars. Only the first items of a large value are shown,
+    followed by its length if items were left out. Other values are
+    returned unchanged, so that they are formatted exactly as before.
+    """
+    if not _is_large(value, max_items, max_chars):
+        return value
+    text = _short_repr(value, max_items, max_chars)
+    if len(value) > max_items:
+        text += ' ({} items)'.format(len(value))
+    return text
+
+
+def _is_large(value, max_items, max_chars):
+    if isinstance(value, basestring):
+        return len(value) > max_chars
+    if type(value) not in _CONTAINERS:
+        return False
+    if len(value) > max_items:
+        return True
+    if isinstance(value, dict):
+        return any(_is_large(k, max_items, max_chars) or _is_large(v, max_items, max_chars)
+                   for k, v in value.iteritems())
+    return any(_is_large(x, max_items, max_chars) for x in value)
+
+
+def _short_repr(value, max_items, max_chars):
+    """Returns repr(value), leaving out items past max_items or max_chars."""
+    brackets = _CONTAINERS.get(type(value))
+    if brackets is None:
+        if isinstance(value, basestring) and len(value) > max_chars:
+            return repr(value[:max_chars]) + '...'
+        return repr(value)
+
+    is_dict = isinstance(value, dict)
+    parts = []
+    length = 0
+    for i, item in enumerate(value.iteritems() if is_dict else value):
+        if i == max_items or length > max_chars:
+            parts.append('...')
+            break
+        if is_dict:
+            part = '{}: {}'.format(_short_repr(item[0], max_items, max_chars),
+                                   _short_repr(item[1], max_items, max_chars))
+        else:
+            part = _short_repr(item, max_items, max_chars)
+        parts.append(part)
+        length += len(part) + 2
+    if type(value) is tuple and len(value) == 1:
+        return '(' + parts[0] + ',)'
+    return brackets[0] + ', '.join(parts) + brackets[1]
+
+
 def wrap_script_with_main(student_file):
     """Wraps a script with a main() function."""
     with open(student_file, 'r') as f:
@@ -18,26 +198,286 @@ def wrap_script_with_main(student_file):
         f.write("if __name__ == '__main__':\n    main()")
 
 
+class CaptureBuffer(object):
+    """A file-like object that keeps at most limit characters written to it.
+
+    Characters past the limit are only counted, and getvalue() ends with
+    a marker saying how many were left out. Buffers are reused by
+    capture_stdout, which calls clear() between uses.
+    """
+    marker = '\n... ({} more characters not shown)'
+    softspace = 0  # used by the print statement
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.dropped = 0
+        self._io = StringIO()
+
+    def write(self, s):
+        if self.limit is not None:
+            room = self.limit - self._io.tell()
+            if len(s) > room:
+                room = max(room, 0)
+                self.dropped += len(s) - room
+                s = s[:room]
+        self._io.write(s)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def getvalue(self):
+        value = self._io.getvalue()
+        if self.dropped:
+            value += self.marker.format(self.dropped)
+        return value
+
+    def clear(self):
+        self._io.reset()
+        self._io.truncate()
+        self.dropped = 0
+        self.softspace = 0
+
+
+class Captured(object):
+    """What was written during capture_stdout, as its captured attribute."""
+    __slots__ = ('_buffer', '_value')
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._value = None
+
+    @property
+    def captured(self):
+        if self._buffer is not None:
+            return self._buffer.getvalue()
+        return self._value
+
+
+# Unused CaptureBuffers, so that capture_stdout can be nested but does not
+# create a buffer every time.
+_BUFFERS = []
+
+
 @contextmanager
-def capture_stdout():
+def capture_stdout(limit=None, fd=False):
+    """Captures what is written to sys.stdout in the body.
+
+    Yields a Captured. At most limit characters are kept (see
+    CaptureBuffer). With fd=True, file descriptor 1 is redirected as well,
+    which catches output of C extensions and subprocesses. That output is
+    added after the output written to sys.stdout.
+    """
+    buffer = _BUFFERS.pop() if _BUFFERS else CaptureBuffer()
+    buffer.limit = limit
+    result = Captured(buffer)
+    fd_output = None
     oldout = sys.stdout
-    newout = StringIO()
-    sys.stdout = newout
-
-    class Out:
-        @property
-        def captured(self):
-            try:
-                val = newout.getvalue()
-                self._captured = val
-                return self._captured
-            except ValueError:
-                # After closing context manager.
-                return self._captured
-
-    result = Out()
-    yield result
-
-    result.captured  # set result._captured before closing newout
-    newout.close()
-    sys.stdout = oldout
+    sys.stdout = buffer
+    try:
+        if fd:
+            with _capture_fd(1) as fd_output:
+                yield result
+        else:
+            yield result
+    finally:
+        sys.stdout = oldout
+        if fd_output:
+            _read_capped(fd_output, buffer)
+        result._value = buffer.getvalue()
+        result._buffer = None
+        buffer.clear()
+        _BUFFERS.append(buffer)
+
+
+@contextmanager
+def _capture_fd(fd):
+    """Redirects fd to a temporary file while in the body.
+
+    Yields the file, which holds the output when the body is done.
+    """
+    _flush_stdio()
+    saved = os.dup(fd)
+    output = os.tmpfile()
+    os.dup2(output.fileno(), fd)
+    try:
+        yield output
+    finally:
+        _flush_stdio()
+        os.dup2(saved, fd)
+        os.close(saved)
+        output.seek(0)
+
+
+def _read_capped(output, buffer):
+    """Writes the contents of the file output to buffer and closes output."""
+    size = os.fstat(output.fileno()).st_size
+    text = output.read() if buffer.limit is None else output.read(buffer.limit)
+    buffer.write(text)
+    buffer.dropped += size - len(text)
+    output.close()
+
+
+def _flush_stdio():
+    """Flushes sys.__stdout__ and the C library's stdio buffers."""
+    sys.__stdout__.flush()
+    if _libc is not None:
+        _libc.fflush(None)
+
+
+# Deadline, seconds and identity of each active time_limit, outermost first.
+_LIMITS = []
+# While a limit is exceeded, Timeout is raised again this often, in case
+# the code under the limit catches it.
+_REPEAT = 0.1
+# If code still runs this many repeats after a limit, on_ignored_limit is
+# called with the seconds of the limit. A process that can be given up,
+# like a forked child (see zygote), sets it to exit.
+_ESCALATE = 20
+on_ignored_limit = None
+
+
+@contextmanager
+def time_limit(seconds):
+    """Raises Timeout if the body runs for more than seconds.
+
+    Yields an object identifying this limit, which is stored as the
+    `limit` attribute of the Timeout. Timeout is raised again every
+    _REPEAT seconds until the body exits, so that code catching it cannot
+    easily run on; code that catches every Timeout only ends if
+    on_ignored_limit ends the process. Limits can be nested; an inner limit that would expire after
+    an enclosing one has no effect, and an enclosing limit is enforced
+    even while an inner one is exceeded. Uses SIGALRM, so limits are only
+    enforced in the main thread of Unix processes.
+    """
+    if not seconds or not hasattr(signal, 'setitimer') or not _main_thread():
+        yield None
+        return
+
+    deadline = time.time() + seconds
+    if _LIMITS and _LIMITS[-1][0] <= deadline:
+        yield None  # the enclosing limit expires first
+        return
+
+    limit = object()
+    if not _LIMITS:
+        old_handler = signal.signal(signal.SIGALRM, _alarm)
+    _LIMITS.append((deadline, seconds, limit))
+    _arm()
+    try:
+        yield limit
+    finally:
+        _LIMITS.pop()
+        if _LIMITS:
+            _arm()  # resume the enclosing limit
+        else:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, old_handler)
+
+
+def _arm():
+    """Sets the timer for the innermost active limit, which expires first."""
+    remaining = _LIMITS[-1][0] - time.time()
+    signal.setitimer(signal.ITIMER_REAL, max(remaining, 1e-6), _REPEAT)
+
+
+def _alarm(signum, frame):
+    # Raise for the outermost exceeded limit, if any.
+    now = time.time()
+    for deadline, seconds, limit in _LIMITS:
+        if now >= deadline - 1e-3:
+            if on_ignored_limit and now >= deadline + _REPEAT * _ESCALATE:
+                on_ignored_limit(seconds)
+            raise Timeout(seconds, limit)
+
+
+class CPULimitExceeded(LimitExceeded):
+    """Raised in code that uses more CPU time than a Sandbox allows."""
+
+
+class Sandbox(object):
+    """Limits the resources available to code run inside it.
+
+    Args:
+        memory (int): bytes of address space that may be allocated on top
+          of what the process already uses. Exceeding this raises
+          MemoryError. Only supported on Linux.
+        cpu (int): CPU seconds that may be used. Exceeding this raises
+          CPULimitExceeded. The limit has a resolution of one second.
+        recursion (int): stack frames that may be added to the current
+          stack. Exceeding this raises RuntimeError.
+
+    Limits apply to the whole process while the sandbox is active, so the
+    body should run nothing but the code under test.
+    """
+    def __init__(self, memory=None, cpu=None, recursion=None):
+        self.memory = memory
+        self.cpu = cpu
+        self.recursion = recursion
+        self._restore = []
+
+    def __enter__(self):
+        undo = []
+        if self.recursion:
+            old = sys.getrecursionlimit()
+            sys.setrecursionlimit(_stack_depth() + self.recursion)
+            undo.append(lambda: sys.setrecursionlimit(old))
+        if self.memory and resource:
+            used = _address_space()
+            if used:
+                undo.append(_set_soft_limit(resource.RLIMIT_AS, used + self.memory))
+        if self.cpu and resource and _main_thread():
+            used = sum(resource.getrusage(resource.RUSAGE_SELF)[:2])
+            def xcpu(signum, frame):
+                raise CPULimitExceeded('exceeded the CPU limit of {} seconds'
+                                       .format(self.cpu))
+            old_handler = signal.signal(signal.SIGXCPU, xcpu)
+            undo.append(lambda: signal.signal(signal.SIGXCPU, old_handler))
+            soft = int(math.ceil(used)) + self.cpu
+            undo.append(_set_soft_limit(resource.RLIMIT_CPU, soft))
+        self._restore.append(undo)
+        return self
+
+    def __exit__(self, *exc_info):
+        for restore in reversed(self._restore.pop()):
+            restore()
+
+
+def _set_soft_limit(kind, soft):
+    """Lowers the soft limit of kind, returning a function to restore it."""
+    old_soft, hard = resource.getrlimit(kind)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    if old_soft != resource.RLIM_INFINITY:
+        soft = min(soft, old_soft)
+    resource.setrlimit(kind, (soft, hard))
+    return lambda: resource.setrlimit(kind, (old_soft, hard))
+
+
+def _address_space():
+    """Returns the bytes of address space used by this process, or None."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[0])
+    except (IOError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def _stack_depth():
+    frame = sys._getframe(1)
+    depth = 0
+    while frame:
+        depth += 1
+        frame = frame.f_back
+    return depth
+
+
+def _main_thread():
+    return isinstance(threading.current_thread(), threading._MainThread)
\ No newline at end of file
@@ -0,0 +1,211 @@
+"""Grades submissions as they are written to a directory.
+
+`grade.py -watch DIR` waits for student .py files under DIR to be
+created or modified, and grades each one once it has not changed for
+DELAY seconds, as `grade.py FILE` would. Changes are noticed with inotify
+on Linux, and by scanning DIR every POLL_INTERVAL seconds elsewhere.
+Files existing when watching starts are not graded.
+"""
+from __future__ import print_function
+import errno
+import os
+import select
+import struct
+import sys
+import time
+import traceback
+
+import command_line
+
+try:
+    import ctypes
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _libc.inotify_init1
+except (ImportError, OSError, AttributeError):
+    _libc = None
+
+DELAY = 2.0
+POLL_INTERVAL = 1.0
+
+# From <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct('iIII')
+
+
+def watch(directory, args, tester=None, grade_package=None, delay=DELAY):
+    """Grades the submissions written to directory until interrupted.
+
+    args are the command line arguments, as for command_line.run_tests.
+    With a tester, only modules named like its master module are graded.
+    """
+    registry = command_line.TesterRegistry(tester, grade_package)
+    watcher = make_watcher(directory)
+    pending = {}  # path -> time of the last change
+    no_script = set()  # modules without a test script
+    if tester:
+        # Not helper modules submitted along with the graded one.
+        graded = os.path.basename(tester.master_mod.__file__).split('.')[0]
+        is_graded = lambda path: os.path.basename(path).split('.')[0] == graded
+    else:
+        is_graded = lambda path: True
+    print('Watching {} for submissions'.format(directory), file=sys.stderr)
+    try:
+        while True:
+            timeout = None
+            if pending:
+                timeout = max(min(pending.values()) + delay - time.time(), 0)
+            for path in watcher.changes(timeout):
+                if is_submission(path) and is_graded(path):
+                    pending[path] = time.time()
+
+            now = time.time()
+            ready = sorted(path for path, changed in pending.items()
+                           if now - changed >= delay)
+            for path in ready:
+                del pending[path]
+            ready = [path for path in ready if os.path.isfile(path)]
+            if ready:
+                _grade(ready, registry, args, no_script)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+def make_watcher(directory):
+    """Returns an InotifyWatcher for directory, or a PollingWatcher."""
+    if _libc is not None:
+        try:
+            return InotifyWatcher(directory)
+        except OSError:
+            pass
+    return PollingWatcher(directory)
+
+
+def is_submission(path):
+    """Returns True for student modules, rather than feedback or temporary files."""
+    name = os.path.basename(path)
+    return (name.endswith('.py') and not name.startswith('.') and
+            '_feedback' not in name)
+
+
+class InotifyWatcher(object):
+    """Reports the files changed under a directory, using inotify.
+
+    Every subdirectory is watched, including those created later.
+    """
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, directory):
+        self.fd = _libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self._dirs = {}  # watch descriptor -> path
+        self._add_tree(directory)
+
+    def changes(self, timeout=None):
+        """Returns the files changed within timeout seconds (None waits)."""
+        try:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return []
+        if not ready:
+            return []
+
+        data = os.read(self.fd, 1 << 16)
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                continue  # events were lost; the next write is seen
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+
+            path = os.path.join(self._dirs.get(wd, ''), name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may be in it before it is watched.
+                    paths.extend(self._add_tree(path))
+            else:
+                paths.append(path)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+    def _add_tree(self, directory):
+        """Watches directory and its subdirectories, and returns their files."""
+        files = []
+        for root, _, names in os.walk(directory):
+            wd = _libc.inotify_add_watch(self.fd, root, self.MASK)
+            if wd >= 0:
+                self._dirs[wd] = root
+            files.extend(os.path.join(root, name) for name in names)
+        return files
+
+
+class PollingWatcher(object):
+    """Reports the files changed under a directory, by scanning it."""
+    def __init__(self, directory, interval=POLL_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self._stats = self._scan()
+
+    def changes(self, timeout=None):
+        """Returns the files changed within timeout seconds (None waits)."""
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        stats = self._scan()
+        changed = [path for path, stat in stats.items()
+                   if self._stats.get(path) != stat]
+        self._stats = stats
+        return changed
+
+    def close(self):
+        pass
+
+    def _scan(self):
+        stats = {}
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if is_submission(name):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue  # deleted since listing
+                    stats[path] = (stat.st_mtime, stat.st_size)
+        return stats
+
+
+def _grade(files, registry, args, no_script):
+    """Grades files, skipping and remembering modules without a test script."""
+    module = lambda file: os.path.basename(file)[:-3]
+    files = [file for file in files if module(file) not in no_script]
+    groups = registry.group(files)
+    grouped = set(file for _, group in groups for file in group)
+    no_script.update(module(file) for file in files if file not in grouped)
+    try:
+        if getattr(args, 'fork', None):
+            import zygote
+            zygote.run(args, groups)
+        else:
+            for tester, group in groups:
+                for file in group:
+                    command_line.grade_file(tester, file, args)
+        command_line._WRITER.flush()
+    except Exception:
+        traceback.print_exc()  # keep watching
@@ -0,0 +1,182 @@
+"""Grades each submission in a forked child of a warm parent process.
+
+The parent process loads the Testers and computes their cached master
+Checks once (see Tester.warm_cache). Every submission is then graded by
+a child forked from it, which shares that state copy-on-write and exits
+afterwards. Nothing a submission does to the Tester, sys.modules or
+sys.stdin can leak into the next one, and a submission that crashes or
+calls os._exit only loses its own feedback. So does one that catches
+every utils.Timeout to run past its time limit, as its child exits.
+"""
+from __future__ import print_function
+from collections import deque
+import errno
+import os
+import select
+import signal
+import sys
+import time
+import traceback
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import command_line
+import utils
+
+# The exit status of a child whose student code ignored its time limit.
+IGNORED_LIMIT = 75
+
+
+def run(args, groups, profiler=None):
+    """Grades the files of groups, a list of (tester, files) pairs.
+
+    Up to args.jobs children run at once. A child that runs for more than
+    args.fork_timeout seconds, if given, is killed. Messages are printed in grading order,
+    and the timings of the children are collected in profiler.
+    """
+    for tester, _ in groups:
+        tester.warm_cache()
+
+    queue = deque((tester, file) for tester, files in groups for file in files)
+    jobs = max(getattr(args, 'jobs', 1), 1)
+    children = []  # in grading order
+    try:
+        while queue or children:
+            while queue and sum(not c.done for c in children) < jobs:
+                tester, file = queue.popleft()
+                children.append(_Child(tester, file, args))
+            _wait(children, getattr(args, 'fork_timeout', None))
+            while children and children[0].done:
+                output, events = children.pop(0).result()
+                sys.stdout.write(output)
+                if profiler:
+                    profiler.events.extend(events)
+    except KeyboardInterrupt:
+        for child in children:
+            child.kill('interrupted')
+        raise
+    finally:
+        for child in children:
+            child.reap()
+
+
+class _Child(object):
+    """A forked child process grading one file.
+
+    The child sends what it printed and its timings through a pipe as a
+    pickle, which the parent reads as it arrives.
+    """
+    def __init__(self, tester, file, args):
+        self.file = file
+        self.start = time.time()
+        self.done = False
+        self.killed = None  # why the child was killed
+        self.status = None
+        self._chunks = []
+        sys.stdout.flush()
+        sys.stderr.flush()
+        read_fd, write_fd = os.pipe()
+        self.pid = os.fork()
+        if self.pid == 0:
+            os.close(read_fd)
+            _grade_child(tester, file, args, write_fd)
+        os.close(write_fd)
+        self.fd = read_fd
+
+    def read(self):
+        """Reads what is available from the pipe, and reaps the child at EOF."""
+        data = os.read(self.fd, 1 << 16)
+        if data:
+            self._chunks.append(data)
+        else:
+            os.close(self.fd)
+            self.reap()
+            self.done = True
+
+    def kill(self, reason):
+        if self.killed or self.status is not None:
+            return
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+        self.killed = reason
+
+    def reap(self):
+        if self.status is None:
+            _, self.status = os.waitpid(self.pid, 0)
+
+    def result(self):
+        """Returns the output and timings of the child."""
+        if self.status == 0 and not self.killed:
+            try:
+                return pickle.loads(''.join(self._chunks))
+            except Exception:
+                pass
+        if self.killed:
+            error = 'was stopped: ' + self.killed
+        elif os.WIFEXITED(self.status) and os.WEXITSTATUS(self.status) == IGNORED_LIMIT:
+            error = 'was stopped: student code kept running past its time limit'
+        elif os.WIFSIGNALED(self.status):
+            error = 'killed by signal {}'.format(os.WTERMSIG(self.status))
+        else:
+            error = 'exited with status {}'.format(os.WEXITSTATUS(self.status))
+        print('ERROR: grading {} {}'.format(self.file, error), file=sys.stderr)
+        return '', []
+
+
+def _wait(children, timeout):
+    """Reads from running children until one finishes or times out."""
+    running = [c for c in children if not c.done]
+    if not running:
+        return
+    wait = None
+    if timeout:
+        now = time.time()
+        for child in running:
+            if now - child.start >= timeout:
+                child.kill('took more than {:g} seconds'.format(timeout))
+        deadlines = [c.start + timeout for c in running if not c.killed]
+        if deadlines:
+            wait = max(min(deadlines) - now, 0)
+    try:
+        ready, _, _ = select.select([c.fd for c in running], [], [], wait)
+    except select.error as e:
+        if e.args[0] != errno.EINTR:
+            raise
+        return
+    for child in running:
+        if child.fd in ready:
+            child.read()
+
+
+def _grade_child(tester, file, args, fd):
+    """Grades file in a forked child, sends the result to fd and exits."""
+    status = 1
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        utils.on_ignored_limit = lambda seconds: os._exit(IGNORED_LIMIT)
+        from cStringIO import StringIO
+        out = StringIO()
+        def echo(msg):
+            out.write(msg + '\n')
+
+        if tester.profiler:
+            tester.profiler.take()  # recorded by the parent
+        command_line.grade_file(tester, file, args, echo=echo)
+        command_line._WRITER.flush()  # os._exit does not run atexit functions
+        events = tester.profiler.take() if tester.profiler else []
+        data = pickle.dumps((out.getvalue(), events), pickle.HIGHEST_PROTOCOL)
+        written = 0
+        while written < len(data):
+            written += os.write(fd, buffer(data, written))
+        status = 0
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)